@@ -1,7 +1,39 @@
 import os
+import re
+import sys
+import json
 import requests
 import argparse
 import time
+import hashlib
+import queue
+import threading
+import itertools
+import fnmatch
+import socketserver
+import select
+import struct
+import ctypes
+import ctypes.util
+import sqlite3
+import socket
+import multiprocessing
+import collections
+import contextlib
+import array
+import tempfile
+import tracemalloc
+import heapq
+import shutil
+import signal
+import urllib.parse
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
 
 # API configuration variables
 API_URL = "http://localhost:11434"
@@ -10,6 +42,100 @@ API_MODEL = "qwen2:7b"
 API_TEMPERATURE = 0.5
 API_MAX_TOKENS = 1024
 API_ENDPOINT = "/v1/chat/completions"
+# "openai" uses API_ENDPOINT; "ollama" uses the native OLLAMA_ENDPOINT with per-request options.
+API_BACKEND = "openai"
+API_BACKENDS = ("openai", "ollama")
+OLLAMA_ENDPOINT = "/api/chat"
+# num_ctx is rounded up to a power of two and sized for a full chunk; it only ever grows
+# during a run, since every change reloads the model.
+OLLAMA_MIN_CONTEXT = 2048
+OLLAMA_MAX_CONTEXT = 32768
+API_TIMEOUT = 30
+API_RETRIES = 2
+
+# Adaptive concurrency (AIMD) per endpoint
+API_WORKERS = 8
+API_INITIAL_CONCURRENCY = 2
+API_LATENCY_TOLERANCE = 2.0
+API_BACKOFF = 0.5
+
+# Request hedging: duplicate a straggler to another endpoint after the running p95 latency
+HEDGE_BUDGET = 0.1
+HEDGE_PERCENTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.5
+
+# Rate limits shared with other users of the endpoints
+RATE_LIMIT_KEYS = ("requests_per_second", "tokens_per_minute")
+# Seconds of traffic each bucket may send in a burst
+RATE_LIMIT_BURST = {"requests_per_second": 1.0, "tokens_per_minute": 10.0}
+RATE_LIMITS_CHECK_INTERVAL = 5.0
+
+# Tiered routing: with a fast model, chunks with little prose skip the large model
+ROUTING_SHORT_LINE = 100
+ROUTING_MAX_PROSE = 300
+ROUTING_TIERS = ("fast", "large")
+
+# Local language identification: content already in the target language, or without
+# prose, is passed through without a request
+LANGUAGE_NO_PROSE = "none"
+# Share of the letters that must be in one script, with each Han, kana or Hangul
+# character weighted like several Latin letters
+LANGUAGE_MIN_SHARE = 0.8
+LANGUAGE_CJK_WEIGHT = 3
+LANGUAGE_KANA_SHARE = 0.1
+# Latin-script languages are told apart by their most frequent words, which must make
+# up a good share of the text so that other languages are not taken for the nearest one.
+LANGUAGE_MIN_STOPWORDS = 3
+LANGUAGE_MIN_STOPWORD_RATE = 0.15
+LANGUAGE_STOPWORD_MARGIN = 1.5
+
+# Order in which queued chunks are translated
+SCHEDULE_POLICIES = ("fifo", "shortest", "round-robin")
+
+# Validation of translated chunks
+VALIDATION_RETRIES = 2
+# Rough characters per unit of meaning, used to bound the length ratio of a translation.
+LANGUAGE_LENGTH_FACTORS = {"zh-CN": 0.35, "zh-TW": 0.35, "ja": 0.5}
+VALIDATION_MIN_LENGTH = 40
+VALIDATION_LENGTH_BOUNDS = (0.4, 2.5)
+
+# Throughput of previous runs, used by --plan to estimate durations
+HISTORY_FILE = "ollama-translator-history.jsonl"
+HISTORY_RUNS = 20
+
+# Sampling interval of the --profiling stack sampler, in seconds
+PROFILE_INTERVAL = 0.005
+PROFILE_TOP_FUNCTIONS = 30
+
+# Processes used to read, split and hash files
+CPU_WORKERS = os.cpu_count() or 1
+PREPROCESS_BATCH = 32
+
+# Memory bounds: chunks queued ahead of translation, and translated chunks kept for reuse
+MAX_PENDING_CHUNKS = 2000
+CHUNK_CACHE_SIZE = 20000
+
+# Daemon mode
+DAEMON_HOST = "127.0.0.1"
+DAEMON_PORT = 8765
+
+# Watch mode
+WATCH_DEBOUNCE = 0.5
+WATCH_POLL_INTERVAL = 1.0
+
+# Shared work queue
+QUEUE_LEASE_SECONDS = 120
+QUEUE_HEARTBEAT_SECONDS = 30
+QUEUE_MAX_ATTEMPTS = 3
+QUEUE_POLL_INTERVAL = 2.0
+
+# i18n mode: string values of locale files are translated many per request
+I18N_EXTENSIONS = (".json", ".yaml", ".yml", ".po")
+I18N_PROMPT_SET = "i18n"
+# Source tokens per batch; the reply adds JSON overhead and may be longer than the source.
+I18N_BATCH_TOKENS = 300
+I18N_BATCH_STRINGS = 40
 
 # Language dictionary for full language names
 lang_dict = {
@@ -26,6 +152,112 @@ lang_dict = {
     "en": "english",
 }
 
+class PhaseTimer:
+    """Accumulate wall-clock and CPU time per phase of a run; does nothing until enabled.
+
+    Phases run concurrently on several threads, so their wall times add up to more than
+    the run's duration. A phase nested in a phase of the same name is counted once.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.totals = {}
+        self.active = threading.local()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        active = self.active.__dict__.setdefault("names", set())
+        if not self.enabled or name in active:
+            yield
+            return
+        active.add(name)
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            active.discard(name)
+            self.add(name, time.perf_counter() - wall_start, time.thread_time() - cpu_start)
+
+    def add(self, name, wall, cpu=0.0, count=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            total = self.totals.setdefault(name, [0.0, 0.0, 0])
+            total[0] += wall
+            total[1] += cpu
+            total[2] += count
+
+    def report(self):
+        lines = [f"{'phase':<14}{'wall s':>10}{'cpu s':>10}{'calls':>9}"]
+        for name, (wall, cpu, count) in sorted(self.totals.items(), key=lambda item: -item[1][0]):
+            lines.append(f"{name:<14}{wall:>10.3f}{cpu:>10.3f}{count:>9}")
+        return "\n".join(lines)
+
+phase_timer = PhaseTimer()
+
+class SamplingProfiler:
+    """Periodically sample the stacks of all threads (cProfile only sees the calling thread)."""
+
+    IDLE_MODULES = ("threading.py", "queue.py", "selectors.py")
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, "thread"))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def write(self, output_dir):
+        """Write collapsed stacks for flamegraph tools and the hottest functions."""
+        os.makedirs(output_dir, exist_ok=True)
+        with open(os.path.join(output_dir, "stacks.collapsed"), "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            leaf = frames[-1] if frames else ""
+            # Threads blocked on a lock or queue are idle rather than hot.
+            if not frames or any(module in leaf for module in self.IDLE_MODULES):
+                continue
+            own[leaf] += count
+            for frame in set(frames):
+                total[frame] += count
+        samples = sum(self.stacks.values()) or 1
+        with open(os.path.join(output_dir, "hot_functions.txt"), "w", encoding="utf-8") as f:
+            f.write(f"{samples} samples every {self.interval * 1000:.0f} ms, idle waits excluded\n\n")
+            f.write("Self time:\n")
+            for frame, count in own.most_common(PROFILE_TOP_FUNCTIONS):
+                f.write(f"{count / samples:8.2%}  {frame}\n")
+            f.write("\nTotal time (including callees):\n")
+            for frame, count in total.most_common(PROFILE_TOP_FUNCTIONS):
+                f.write(f"{count / samples:8.2%}  {frame}\n")
+
 def initialize_api_client(api_key):
     session = requests.Session()
     session.headers.update({"Authorization": f"Bearer {api_key}"})
@@ -35,46 +267,107 @@ def count_tokens(text):
     """Simplified token counting function."""
     return len(text) // 4
 
-def split_text(text, max_tokens):
-    """Split text into smaller chunks ensuring that each chunk ends at a sentence boundary."""
+def split_offsets(text, max_tokens, show_progress=True):
+    """Return (start, end) offsets of chunks ending at line boundaries, each within max_tokens where possible."""
     lines = text.splitlines(True)  # Keep line breaks
-    chunks = []
-    current_chunk = ""
+    spans = []
+    chunk_start = 0
+    position = 0
     current_tokens = 0
 
     total_lines = len(lines)
-    print(f"Calculating splits: {total_lines} lines")
+    if show_progress:
+        print(f"Calculating splits: {total_lines} lines")
 
     for i, line in enumerate(lines):
         line_tokens = count_tokens(line)
-        if current_tokens + line_tokens > max_tokens:
-            chunks.append(current_chunk)
-            current_chunk = line
+        if current_tokens + line_tokens > max_tokens and position > chunk_start:
+            spans.append((chunk_start, position))
+            chunk_start = position
             current_tokens = line_tokens
         else:
-            current_chunk += line
             current_tokens += line_tokens
+        position += len(line)
 
         # Show progress
-        progress = (i + 1) / total_lines
-        display_progress_bar(progress, prefix='Splitting')
+        if show_progress:
+            progress = (i + 1) / total_lines
+            display_progress_bar(progress, prefix='Splitting')
+
+    if position > chunk_start:
+        spans.append((chunk_start, position))
 
-    if current_chunk:
-        chunks.append(current_chunk)
+    return spans
 
-    return chunks
+def split_text(text, max_tokens, show_progress=True):
+    """Split text into smaller chunks ensuring that each chunk ends at a sentence boundary."""
+    return [text[start:end] for start, end in split_offsets(text, max_tokens, show_progress)]
+
+def preprocess_file(file_path, max_tokens):
+    """Read, split, hash and identify the language of one file in a worker process.
+
+    Returns a compact descriptor (file_path, text length, [(start, end, digest, language)],
+    (read wall, read CPU, split wall, split CPU seconds)) rather than the chunk texts, or
+    (file_path, None, error message, None) if the file cannot be read.
+    """
+    start_time = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            file_content = f.read()
+    except FileNotFoundError:
+        return file_path, None, f"Input file not found: {file_path}", None
+    except UnicodeDecodeError:
+        return file_path, None, f"Could not decode file {file_path} using utf-8 encoding.", None
+    read_time = time.perf_counter()
+    read_cpu = time.thread_time()
+    offsets = split_offsets(file_content, max_tokens, show_progress=False)
+    languages = identify_spans(file_content, offsets)
+    spans = [
+        (start, end, hashlib.sha256(file_content[start:end].encode("utf-8")).digest(), span_language)
+        for (start, end), span_language in zip(offsets, languages)
+    ]
+    timings = (read_time - start_time, read_cpu - cpu_start, time.perf_counter() - read_time, time.thread_time() - read_cpu)
+    return file_path, len(file_content), spans, timings
+
+def preprocess_batch(file_paths, max_tokens):
+    return [preprocess_file(file_path, max_tokens) for file_path in file_paths]
+
+def preprocess_files(all_files, max_tokens, cpu_workers=None):
+    """Yield preprocess_file descriptors in file order, using a process pool for more than one worker.
+
+    all_files may be any iterable, such as a directory walk in progress. Only a few
+    batches per process are read ahead of the consumer, so memory does not grow with
+    the number of files.
+    """
+    cpu_workers = cpu_workers or CPU_WORKERS
+    if cpu_workers <= 1 or (hasattr(all_files, "__len__") and len(all_files) < 2):
+        for file_path in all_files:
+            yield preprocess_file(file_path, max_tokens)
+        return
+    # The scheduler's threads are already running, so avoid a plain fork.
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    with ProcessPoolExecutor(max_workers=cpu_workers, mp_context=multiprocessing.get_context(method)) as executor:
+        pending = collections.deque()
+        files = iter(all_files)
+        while True:
+            batch = list(itertools.islice(files, PREPROCESS_BATCH))
+            if batch:
+                pending.append(executor.submit(preprocess_batch, batch, max_tokens))
+            if pending and (not batch or len(pending) >= 2 * cpu_workers):
+                yield from pending.popleft().result()
+            elif not batch:
+                return
 
 def display_progress_bar(progress, prefix='', length=40, suffix=''):
     """Display a simple progress bar."""
-    block = int(round(length * progress))
-    bar = '||' + '+' * block + '=' * (length - block) + '||'
-    print(f'\r{prefix}: {bar} {int(progress * 100)}% {suffix}', end='', flush=True)
+    with phase_timer.phase("progress"):
+        block = int(round(length * progress))
+        bar = '||' + '+' * block + '=' * (length - block) + '||'
+        print(f'\r{prefix}: {bar} {int(progress * 100)}% {suffix}', end='', flush=True)
 
-def translate_full(full_text, input_lang, target_lang, client):
+def default_prompts(input_lang_full, target_lang_full):
     format = "markdown"
-    input_lang_full = lang_dict.get(input_lang, input_lang)
-    target_lang_full = lang_dict.get(target_lang, target_lang)
-
     system_prompt = (
         f"You are an AI-driven advanced translation system, specifically designed to translate structured and technical documents. "
         f"You will receive a text snippet from a file formatted as:\n{format}\n\n"
@@ -89,29 +382,522 @@ def translate_full(full_text, input_lang, target_lang, client):
         "Remember: your job is to **translate** the text exactly as it is, without adding summaries or changing the content in any way. "
         "Do not skip or modify any part of the text. Ensure that the output is a direct translation, and that the original structure and meaning are preserved."
     )
-    
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "system", "content": code_prompt},
-        {"role": "user", "content": full_text}
-    ]
+    return [system_prompt, code_prompt]
+
+def markdown_prompts(input_lang_full, target_lang_full):
+    system_prompt = (
+        f"You are an advanced AI-driven translation system specialized in translating technical and structured documents. "
+        f"The text you receive will be in Markdown format. Your primary task is to **accurately translate** the text content from {input_lang_full} to {target_lang_full}, "
+        f"while strictly preserving the original Markdown formatting, structure, and syntax. "
+        f"Ensure that every word and sentence is translated precisely, without adding any extra content, commentary, or interpretation. "
+        f"Your output must maintain the integrity of the original document's structure, including headings, lists, code blocks, links, and other Markdown elements. "
+        f"Do not alter or remove any symbols or Markdown syntax. The translated content should reflect the original meaning with the same level of detail and complexity."
+    )
+
+    code_prompt = (
+        "As a translation system, your task is to translate the text exactly as it is, preserving the Markdown syntax and content structure. "
+        "Do not modify, add, or remove any Markdown elements, symbols, or content. "
+        "Ensure that the output is a faithful and precise translation, with the original document's format and structure completely intact."
+    )
+
+    examples_prompt = (
+        "Here is an example of how to handle translation while preserving Markdown formatting:\n\n"
+        "Original: '# 这是一级标题'\n"
+        "Translation: '# This is a first-level heading'\n\n"
+        "Original: '这是一个段落。'\n"
+        "Translation: 'This is a paragraph.'\n\n"
+        "Original: '- 这是一个无序列表项'\n"
+        "Translation: '- This is an unordered list item'\n\n"
+        "Original: '`代码块不应被翻译`'\n"
+        "Translation: '`Code blocks should not be translated`'\n\n"
+        "Follow this exact translation style for the entire document, ensuring all Markdown syntax remains unchanged."
+    )
+    return [system_prompt, code_prompt, examples_prompt]
+
+def technical_prompts(input_lang_full, target_lang_full):
+    format = "markdown"
+    system_prompt = (
+        f"You are an AI-driven advanced translation system, specialized in translating structured and technical documents. "
+        f"You will receive a text snippet from a file formatted as:\n{format}\n\n"
+        f"Your task is to translate the text enclosed between the `🔤` symbols from {input_lang_full} to {target_lang_full}. "
+        f"Preserve the original formatting, sentence structure, and terminology, ensuring the translation is precise and faithful to the source. "
+        f"The translated text must adhere to the academic or technical standards expected in the target language, reflecting the original length and complexity. "
+        f"Avoid altering the meaning or making unnecessary changes. "
+        f"Deliver the translation exactly as required, without any additional commentary or explanation, and ensure the `🔤` symbols are removed in the final output."
+    )
+
+    code_prompt = "Make sure don't translate code blocks in markdown format, and don't translate image paths in :src field, and do translate the alt field from img tag"
+    return [system_prompt, code_prompt]
+
+def i18n_prompts(input_lang_full, target_lang_full):
+    system_prompt = (
+        f"You are an AI-driven translation system for user interface strings. "
+        f"You will receive a JSON object that maps IDs to strings in {input_lang_full}. "
+        f"Translate every string to {target_lang_full} and reply with a JSON object that has exactly the same IDs, each mapped to its translation. "
+        f"Keep placeholders such as {{name}}, {{{{count}}}}, %s and %(count)d, HTML tags and surrounding whitespace unchanged. "
+        f"Reply with the JSON object only, without any additional commentary or explanation."
+    )
+    return [system_prompt]
+
+# Prompt sets selectable by model profiles
+PROMPT_SETS = {
+    "default": default_prompts,
+    "markdown": markdown_prompts,
+    "technical": technical_prompts,
+    I18N_PROMPT_SET: i18n_prompts,
+}
+
+# Named model profiles; entries in PROFILES_FILE override or extend these.
+PROFILES_FILE = "ollama-translator-profiles.json"
+MODEL_PROFILES = {
+    "qwen2": {"model": "qwen2:7b", "chunk_tokens": 1024, "max_tokens": 1024, "prompt_set": "default", "workers": API_WORKERS},
+    "qwen2-markdown": {"model": "qwen2:7b", "chunk_tokens": 500, "max_tokens": 500, "prompt_set": "markdown", "workers": API_WORKERS},
+    "mistral-nemo": {"model": "mistral-nemo:12b", "chunk_tokens": 2048, "max_tokens": 2048, "prompt_set": "technical", "workers": API_WORKERS},
+}
+DEFAULT_PROFILE = "qwen2"
+PROFILE_SETTINGS = ("model", "max_tokens", "chunk_tokens", "prompt_set", "workers")
+
+def context_size(messages, max_tokens, minimum=OLLAMA_MIN_CONTEXT):
+    """Smallest power-of-two context of at least minimum that fits the messages and the output budget."""
+    # Bytes / 3 over-estimates tokens for Latin text and roughly matches CJK text.
+    needed = sum(len(message["content"].encode("utf-8")) // 3 + 8 for message in messages) + max_tokens
+    size = minimum
+    while size < needed and size < OLLAMA_MAX_CONTEXT:
+        size *= 2
+    return size
 
+def run_context_size(chunk_tokens, max_tokens, prompt_set=None):
+    """The context for a full chunk of Latin-script text with the prompts of prompt_set."""
+    prompts = PROMPT_SETS[prompt_set or "default"]("english", "english")
+    messages = [{"role": "system", "content": prompt} for prompt in prompts]
+    messages.append({"role": "user", "content": "x" * (4 * chunk_tokens)})
+    return context_size(messages, max_tokens)
+
+def request_ollama(messages, client, api_url, model, temperature, max_tokens, num_ctx=None):
+    """Call the native /api/chat endpoint, returning the reply and the server's timing split.
+
+    num_ctx is used unless the messages need a larger context.
+    """
+    num_ctx = context_size(messages, max_tokens, num_ctx or OLLAMA_MIN_CONTEXT)
     start_time = time.time()
     response = client.post(
-        API_URL + API_ENDPOINT,
+        api_url + OLLAMA_ENDPOINT,
         json={
-            "model": API_MODEL,
+            "model": model,
             "messages": messages,
-            "temperature": API_TEMPERATURE,
-            "max_tokens": API_MAX_TOKENS
+            "stream": False,
+            "options": {"temperature": temperature, "num_predict": max_tokens, "num_ctx": num_ctx}
         },
-        timeout=30
+        timeout=API_TIMEOUT
     )
+    response.raise_for_status()
     elapsed_time = time.time() - start_time
-    return response.json()["choices"][0]["message"]["content"], elapsed_time
+    body = response.json()
+    content = body["message"]["content"]
+    return {
+        "content": content,
+        "elapsed": elapsed_time,
+        "finish_reason": body.get("done_reason"),
+        "output_tokens": body.get("eval_count") or count_tokens(content),
+        "server": {
+            "num_ctx": num_ctx,
+            "prompt_eval_count": body.get("prompt_eval_count", 0),
+            "eval_count": body.get("eval_count", 0),
+            # Durations are reported in nanoseconds.
+            "load": body.get("load_duration", 0) / 1e9,
+            "prompt_eval": body.get("prompt_eval_duration", 0) / 1e9,
+            "eval": body.get("eval_duration", 0) / 1e9,
+            "total": body.get("total_duration", 0) / 1e9,
+        },
+    }
+
+def request_translation(full_text, input_lang, target_lang, client, api_url=None, model=None, temperature=None, max_tokens=None, prompt_set=None,
+                        backend=None, num_ctx=None):
+    """Send one chunk to the model and return its translation along with request details."""
+    input_lang_full = lang_dict.get(input_lang, input_lang)
+    target_lang_full = lang_dict.get(target_lang, target_lang)
 
-def translate_file(input_path, output_path, base_lang, target_lang, client):
-    print(f"Processing file: {input_path}")
+    prompts = PROMPT_SETS[prompt_set or "default"](input_lang_full, target_lang_full)
+    messages = [{"role": "system", "content": prompt} for prompt in prompts]
+    messages.append({"role": "user", "content": full_text})
+
+    if (backend or API_BACKEND) == "ollama":
+        return request_ollama(messages, client, api_url or API_URL, model or API_MODEL,
+                              API_TEMPERATURE if temperature is None else temperature, max_tokens or API_MAX_TOKENS, num_ctx)
+
+    start_time = time.time()
+    response = client.post(
+        (api_url or API_URL) + API_ENDPOINT,
+        json={
+            "model": model or API_MODEL,
+            "messages": messages,
+            "temperature": API_TEMPERATURE if temperature is None else temperature,
+            "max_tokens": max_tokens or API_MAX_TOKENS
+        },
+        timeout=API_TIMEOUT
+    )
+    response.raise_for_status()
+    elapsed_time = time.time() - start_time
+    body = response.json()
+    choice = body["choices"][0]
+    content = choice["message"]["content"]
+    return {
+        "content": content,
+        "elapsed": elapsed_time,
+        "finish_reason": choice.get("finish_reason"),
+        "output_tokens": body.get("usage", {}).get("completion_tokens") or count_tokens(content),
+    }
+
+def translate_full(full_text, input_lang, target_lang, client, api_url=None, model=None, temperature=None, max_tokens=None, prompt_set=None,
+                   backend=None, num_ctx=None):
+    result = request_translation(full_text, input_lang, target_lang, client, api_url, model, temperature, max_tokens, prompt_set, backend,
+                                 num_ctx)
+    return result["content"], result["elapsed"]
+
+FENCE_PATTERN = re.compile(r"^\s*(```|~~~)", re.MULTILINE)
+HEADING_PATTERN = re.compile(r"^\s{0,3}#{1,6}\s", re.MULTILINE)
+LIST_ITEM_PATTERN = re.compile(r"^\s*(?:[-*+]|\d+[.)])\s", re.MULTILINE)
+IMAGE_PATTERN = re.compile(r"!\[[^\]]*\]\(")
+LINK_PATTERN = re.compile(r"(?<!!)\[[^\]]*\]\(")
+COMMENTARY_PATTERN = re.compile(r"^\s*(here is|here's|sure[,!.]|certainly[,!.]|translation:|translated text:)", re.IGNORECASE)
+
+def validate_translation(source, translated, base_lang, target_lang):
+    """Cheap structural checks of a translated chunk; returns a list of problems (empty if it looks right)."""
+    problems = []
+    # A chunk cut inside a long code block has an odd number of fences, like its source.
+    if len(FENCE_PATTERN.findall(translated)) != len(FENCE_PATTERN.findall(source)):
+        problems.append("code fences")
+    for name, pattern in (("headings", HEADING_PATTERN), ("list items", LIST_ITEM_PATTERN),
+                          ("links", LINK_PATTERN), ("images", IMAGE_PATTERN)):
+        expected = len(pattern.findall(source))
+        found = len(pattern.findall(translated))
+        if expected != found:
+            problems.append(f"{name}: expected {expected}, found {found}")
+    if "🔤" in translated and "🔤" not in source:
+        problems.append("leftover 🔤 markers")
+    if COMMENTARY_PATTERN.match(translated) and not COMMENTARY_PATTERN.match(source):
+        problems.append("commentary instead of translation")
+    if len(source.strip()) >= VALIDATION_MIN_LENGTH:
+        expected_ratio = LANGUAGE_LENGTH_FACTORS.get(target_lang, 1.0) / LANGUAGE_LENGTH_FACTORS.get(base_lang, 1.0)
+        ratio = len(translated.strip()) / len(source.strip()) / expected_ratio
+        if not VALIDATION_LENGTH_BOUNDS[0] <= ratio <= VALIDATION_LENGTH_BOUNDS[1]:
+            problems.append(f"length ratio {ratio:.2f} outside {VALIDATION_LENGTH_BOUNDS[0]}-{VALIDATION_LENGTH_BOUNDS[1]}")
+    return problems
+
+PLACEHOLDER_PATTERN = re.compile(r"\{\{[^{}]*\}\}|\{[^{}\s]*\}|%(?:\([^)]*\))?[-+#0]*\d*(?:\.\d+)?[sdifxXeEgGcr]|</?[a-zA-Z][^>]*>")
+PO_FIELD_PATTERN = re.compile(r'^(msgctxt|msgid|msgid_plural|msgstr(?:\[\d+\])?)\s+"(.*)"$')
+PO_ESCAPES = {"n": "\n", "t": "\t", '"': '"', "\\": "\\"}
+
+def chunk_tier(chunk):
+    """Route a chunk to "fast" if it is mostly headings, list items, table cells and short lines, else "large".
+
+    Paragraphs, list items and table cells count as prose when they are longer than
+    ROUTING_SHORT_LINE characters; code blocks are ignored.
+    """
+    prose = 0
+    paragraph = 0
+    in_code = False
+    for line in chunk.splitlines() + [""]:
+        if FENCE_PATTERN.match(line):
+            in_code = not in_code
+            continue
+        stripped = line.strip()
+        if in_code:
+            continue
+        structural = HEADING_PATTERN.match(line) or LIST_ITEM_PATTERN.match(line) or stripped.startswith("|")
+        if structural or not stripped:
+            if paragraph > ROUTING_SHORT_LINE:
+                prose += paragraph
+            paragraph = 0
+        if structural:
+            longest = max(len(cell.strip()) for cell in stripped.split("|"))
+            if longest > ROUTING_SHORT_LINE:
+                prose += longest
+        elif stripped:
+            paragraph += len(stripped) + 1
+    return "fast" if prose <= ROUTING_MAX_PROSE else "large"
+
+SCRIPT_PATTERNS = {
+    "han": re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+"),
+    "kana": re.compile(r"[\u3040-\u30ff]+"),
+    "hangul": re.compile(r"[\uac00-\ud7af]+"),
+    "cyrillic": re.compile(r"[\u0400-\u04ff]+"),
+    "arabic": re.compile(r"[\u0600-\u06ff]+"),
+    "latin": re.compile(r"[a-zA-Z\u00c0-\u024f\u1e00-\u1eff]+"),
+}
+SCRIPT_LANGUAGES = {"hangul": "ko", "cyrillic": "ru", "arabic": "ar"}
+LETTER_PATTERN = re.compile(r"[^\W\d_]+")
+# Inline code, HTML tags, link targets and URLs are not prose.
+NON_PROSE_PATTERN = re.compile(r"`[^`\n]*`|<[^>\n]*>|\]\([^)\s]*\)?|https?://\S+")
+SIMPLIFIED_CHARS = re.compile("[这们说国时会来对为过发经还没么学开关实现问题应该样从动后长书车东门见电话个数据认务运输类码库资网络页错误择选项录户]")
+TRADITIONAL_CHARS = re.compile("[這們說國時會來對為過發經還沒麼學開關實現問題應該樣從動後長書車東門見電話個數據認務運輸類碼庫資網絡頁錯誤擇選項錄戶]")
+STOPWORDS = {
+    "en": frozenset("the and of to is in that for with are this it be as on you not or by can from your if will".split()),
+    "de": frozenset("der die und das ist nicht mit den von zu ein eine für auf sie es dem sich wird werden oder auch im sind".split()),
+    "fr": frozenset("le la les des est et un une du pour que qui dans pas sur vous avec ce sont au par il ne".split()),
+    "es": frozenset("el la los las que y en es un una para por con no se del al como su está son lo".split()),
+    "pt": frozenset("o os as que e em um uma para com não do da dos das é no na se por são ao".split()),
+    "vi": frozenset("của và là các có không được cho một những này trong với để người khi đã".split()),
+    # Not translation targets; recognized so that they are not mistaken for a close one.
+    "it": frozenset("il di che è per non sono della gli questo questa anche più ma ha nel alla dei delle".split()),
+    "nl": frozenset("het een van dat zijn niet met voor je ook bij naar wordt worden kunt dit deze er".split()),
+}
+
+def prose_of(text, in_code=False):
+    """Return the prose of markdown text and whether it ends inside a code block.
+
+    Fenced code blocks, inline code, HTML tags, link targets and URLs are dropped.
+    in_code says whether text starts inside a code block, for chunks split from a file.
+    """
+    lines = []
+    for line in text.splitlines():
+        if FENCE_PATTERN.match(line):
+            in_code = not in_code
+        elif not in_code:
+            lines.append(line)
+    return NON_PROSE_PATTERN.sub(" ", "\n".join(lines)), in_code
+
+def identify_language(prose):
+    """Guess the language of prose locally, from its scripts and, for Latin script, its stopwords.
+
+    Returns a language code, LANGUAGE_NO_PROSE if prose has no letters, or None when
+    unsure (mixed scripts, too few stopwords); content of unknown language is translated.
+    """
+    letters = sum(len(word) for word in LETTER_PATTERN.findall(prose))
+    if not letters:
+        return LANGUAGE_NO_PROSE
+    counts = {script: sum(len(run) for run in pattern.findall(prose)) for script, pattern in SCRIPT_PATTERNS.items()}
+    cjk = counts["han"] + counts["kana"] + counts["hangul"]
+    total = letters + (LANGUAGE_CJK_WEIGHT - 1) * cjk
+    if (counts["han"] + counts["kana"]) * LANGUAGE_CJK_WEIGHT >= LANGUAGE_MIN_SHARE * total:
+        if counts["kana"] >= LANGUAGE_KANA_SHARE * (counts["han"] + counts["kana"]):
+            return "ja"
+        simplified = len(SIMPLIFIED_CHARS.findall(prose))
+        traditional = len(TRADITIONAL_CHARS.findall(prose))
+        if simplified != traditional:
+            return "zh-CN" if simplified > traditional else "zh-TW"
+        return None
+    for script, language in SCRIPT_LANGUAGES.items():
+        weight = LANGUAGE_CJK_WEIGHT if script == "hangul" else 1
+        if counts[script] * weight >= LANGUAGE_MIN_SHARE * total:
+            return language
+    if counts["latin"] < LANGUAGE_MIN_SHARE * total:
+        return None
+    words = collections.Counter(word.lower() for word in SCRIPT_PATTERNS["latin"].findall(prose))
+    scores = sorted(((sum(words[word] for word in stopwords), language) for language, stopwords in STOPWORDS.items()), reverse=True)
+    (best, language), (second, _) = scores[0], scores[1]
+    if (best >= LANGUAGE_MIN_STOPWORDS and best >= LANGUAGE_MIN_STOPWORD_RATE * sum(words.values())
+            and best >= LANGUAGE_STOPWORD_MARGIN * second):
+        return language
+    return None
+
+def identify_spans(text, spans):
+    """Return the language of each (start, end) span of text.
+
+    Code blocks are followed across span boundaries, so a chunk that starts inside one
+    is not mistaken for prose.
+    """
+    in_code = False
+    languages = []
+    for start, end in spans:
+        prose, in_code = prose_of(text[start:end], in_code)
+        languages.append(identify_language(prose))
+    return languages
+
+def already_translated(language, target_lang):
+    """Content needs no request if it is already in the target language or has no prose."""
+    return language in (target_lang, LANGUAGE_NO_PROSE)
+
+def is_translatable(text):
+    """A string needs translating if anything besides placeholders contains letters."""
+    return any(character.isalpha() for character in PLACEHOLDER_PATTERN.sub("", text))
+
+def string_problem(source, translated):
+    """Return why a translated i18n string cannot be used, or None if it can."""
+    if not isinstance(translated, str) or (source.strip() and not translated.strip()):
+        return "missing"
+    if sorted(PLACEHOLDER_PATTERN.findall(source)) != sorted(PLACEHOLDER_PATTERN.findall(translated)):
+        return "placeholders changed"
+    return None
+
+def pack_batches(strings, max_tokens=I18N_BATCH_TOKENS, max_strings=I18N_BATCH_STRINGS):
+    """Group strings into batches of at most max_strings strings and about max_tokens tokens."""
+    batches = []
+    tokens = 0
+    for text in strings:
+        cost = count_tokens(text) + 1
+        if not batches or len(batches[-1]) >= max_strings or tokens + cost > max_tokens:
+            batches.append([])
+            tokens = 0
+        batches[-1].append(text)
+        tokens += cost
+    return batches
+
+def batch_payload(strings):
+    # IDs follow the order of the strings, so the same batch always makes the same request.
+    return json.dumps({str(string_id): text for string_id, text in enumerate(strings, 1)}, ensure_ascii=False, indent=0)
+
+def parse_batch_reply(reply):
+    """Return the JSON object in a batch reply, or None if it has none."""
+    start = reply.find("{")
+    end = reply.rfind("}")
+    if start == -1 or end < start:
+        return None
+    try:
+        result = json.loads(reply[start:end + 1])
+    except ValueError:
+        return None
+    return result if isinstance(result, dict) else None
+
+def validate_batch(source, translated, base_lang, target_lang):
+    """Check that a batch reply can be mapped back to the batch by ID.
+
+    Only a reply that cannot be used at all fails, so the whole batch is sent again.
+    Single missing strings or changed placeholders are left to the caller, which
+    retranslates those strings one by one.
+    """
+    reply = parse_batch_reply(translated)
+    if reply is None:
+        return ["reply is not a JSON object"]
+    if not any(isinstance(reply.get(string_id), str) for string_id in json.loads(source)):
+        return ["reply has none of the IDs"]
+    return []
+
+def po_unescape(value):
+    return re.sub(r'\\(.)', lambda match: PO_ESCAPES.get(match.group(1), match.group(0)), value)
+
+def po_escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\t", "\\t").replace("\n", "\\n")
+
+def parse_po(text):
+    """Split a gettext catalog into entries of comment lines and [keyword, value] fields."""
+    entries = []
+    entry = None
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            entry = None
+            continue
+        if entry is None:
+            entry = {"comments": [], "fields": []}
+            entries.append(entry)
+        match = PO_FIELD_PATTERN.match(stripped)
+        if stripped.startswith("#"):
+            entry["comments"].append(line)
+        elif match:
+            entry["fields"].append([match.group(1), po_unescape(match.group(2))])
+        elif len(stripped) > 1 and stripped[0] == stripped[-1] == '"' and entry["fields"]:
+            entry["fields"][-1][1] += po_unescape(stripped[1:-1])
+        else:
+            raise ValueError(f"unexpected line: {line}")
+    return entries
+
+def render_po(entries, translations, target_lang):
+    lines = []
+    for entry in entries:
+        fields = dict(entry["fields"])
+        msgid = fields.get("msgid", "")
+        lines.extend(entry["comments"])
+        for keyword, value in entry["fields"]:
+            if keyword.startswith("msgstr") and not msgid:
+                # The header entry; only its language changes.
+                value = re.sub(r"^Language: .*$", f"Language: {target_lang}", value, flags=re.MULTILINE)
+            elif keyword in ("msgstr", "msgstr[0]"):
+                value = translations.get(msgid, value)
+            elif keyword.startswith("msgstr["):
+                value = translations.get(fields.get("msgid_plural", msgid), value)
+            lines.append(f'{keyword} "{po_escape(value)}"')
+        lines.append("")
+    return "\n".join(lines)
+
+def read_i18n_file(file_path):
+    """Parse a locale file into its format and document; raises ValueError if it cannot be parsed."""
+    extension = os.path.splitext(file_path)[1].lower()
+    text = read_source_file(file_path)
+    if text is None:
+        raise ValueError("cannot read file")
+    if extension == ".po":
+        return "po", parse_po(text)
+    if extension == ".json":
+        return "json", json.loads(text)
+    if yaml is None:
+        raise ValueError("PyYAML is required for YAML files (pip install pyyaml)")
+    try:
+        return "yaml", yaml.safe_load(text)
+    except yaml.YAMLError as e:
+        raise ValueError(str(e))
+
+def i18n_strings(file_format, document):
+    """Yield the source strings of a parsed locale file in document order."""
+    if file_format == "po":
+        for entry in document:
+            fields = dict(entry["fields"])
+            for keyword in ("msgid", "msgid_plural"):
+                if fields.get(keyword):
+                    yield fields[keyword]
+    elif isinstance(document, dict):
+        for value in document.values():
+            yield from i18n_strings(file_format, value)
+    elif isinstance(document, list):
+        for value in document:
+            yield from i18n_strings(file_format, value)
+    elif isinstance(document, str):
+        yield document
+
+def replace_strings(node, translations):
+    """Copy a JSON/YAML tree with its string values translated; keys and order are kept."""
+    if isinstance(node, dict):
+        return {key: replace_strings(value, translations) for key, value in node.items()}
+    if isinstance(node, list):
+        return [replace_strings(value, translations) for value in node]
+    if isinstance(node, str):
+        return translations.get(node, node)
+    return node
+
+def render_i18n(file_format, document, translations, target_lang):
+    if file_format == "po":
+        return render_po(document, translations, target_lang)
+    translated = replace_strings(document, translations)
+    if file_format == "json":
+        return json.dumps(translated, ensure_ascii=False, indent=2) + "\n"
+    return yaml.safe_dump(translated, allow_unicode=True, sort_keys=False, default_flow_style=False)
+
+def load_profiles(profiles_file=None):
+    """Return the built-in profiles updated with those in the profiles file, if it exists."""
+    profiles = {name: dict(profile) for name, profile in MODEL_PROFILES.items()}
+    path = profiles_file or PROFILES_FILE
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for name, profile in json.load(f).get("profiles", {}).items():
+                profiles.setdefault(name, {}).update(profile)
+    elif profiles_file:
+        print(f"Profiles file not found: {profiles_file}")
+    return profiles
+
+def profile_settings(profile):
+    """The settings of a profile, with those it leaves out filled in the way Translator does."""
+    max_tokens = profile.get("max_tokens") or API_MAX_TOKENS
+    return {
+        "model": profile.get("model") or API_MODEL,
+        "max_tokens": max_tokens,
+        "chunk_tokens": profile.get("chunk_tokens") or max_tokens,
+        "prompt_set": profile.get("prompt_set"),
+        "workers": profile.get("workers") or API_WORKERS,
+    }
+
+def save_profile(name, profile, profiles_file=None):
+    path = profiles_file or PROFILES_FILE
+    data = {"profiles": {}}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    data.setdefault("profiles", {})[name] = profile
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+
+def read_source_file(input_path):
+    """Read a source file, returning None if it cannot be read."""
     try:
         start_time = time.time()
         with open(input_path, "r", encoding="utf-8") as f:
@@ -120,87 +906,2067 @@ def translate_file(input_path, output_path, base_lang, target_lang, client):
         print(f"File read step: {elapsed_time:.2f} seconds")
     except FileNotFoundError:
         print(f"Input file not found: {input_path}")
-        return
+        return None
     except UnicodeDecodeError:
         print(f"Could not decode file {input_path} using utf-8 encoding.")
-        return
-
-    # Progress bar for simulation slice calculation
-    simulate_progress_bar("Preparing to split text")
-
-    start_time = time.time()
-    chunks = split_text(file_content, API_MAX_TOKENS)
-    elapsed_time = time.time() - start_time
-    print(f"\nSplitting step: {elapsed_time:.2f} seconds")
-    
-    translated_chunks = []
-    total_translation_time = 0
+        return None
+    return file_content
 
-    for i, chunk in enumerate(chunks):
-        progress = (i + 1) / len(chunks)
-        suffix = f"{i+1}/{len(chunks)}"
-        display_progress_bar(progress, prefix='Translating chunks', suffix=suffix)
-        translated_chunk, translation_time = translate_full(chunk, base_lang, target_lang, client)
-        translated_chunks.append(translated_chunk)
-        total_translation_time += translation_time
-
-    print(f"\nTotal translation time: {total_translation_time:.2f} seconds")
-
-    translated_text = ''.join(translated_chunks)
+def write_translation(output_path, translated_text, created_dirs=None):
+    """Write a translation unless the output already holds exactly that text.
 
+    The text goes to a temporary file next to the output, which is then renamed over it,
+    so readers never see a partly written file. Unchanged outputs keep their modification
+    time. Directories already in created_dirs are not checked again and new ones are
+    added to it. Returns "written", "unchanged" or "failed".
+    """
     output_dir = os.path.dirname(output_path)
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+    if output_dir and (created_dirs is None or output_dir not in created_dirs):
+        os.makedirs(output_dir, exist_ok=True)
+        if created_dirs is not None:
+            created_dirs.add(output_dir)
 
+    data = translated_text.encode("utf-8")
+    temp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
     try:
         start_time = time.time()
-        with open(output_path, "w", encoding="utf-8") as f:
-            f.write(translated_text)
+        try:
+            # Only files of the same size are read back for comparison.
+            if os.path.getsize(output_path) == len(data):
+                with open(output_path, "rb") as f:
+                    if f.read() == data:
+                        print(f"Translation unchanged: {output_path}")
+                        return "unchanged"
+            existing = True
+        except FileNotFoundError:
+            existing = False
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        if existing:
+            shutil.copymode(output_path, temp_path)
+        os.replace(temp_path, output_path)
         elapsed_time = time.time() - start_time
         print(f"File write step: {elapsed_time:.2f} seconds")
         print(f"Translation saved to {output_path}")
-    except IOError:
+        return "written"
+    except OSError:
         print(f"Cannot write to output file: {output_path}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return "failed"
 
-def simulate_progress_bar(description, duration=0.5):
-    """Simulates a progress bar for a given duration."""
-    print(description)
-    for i in range(101):
-        display_progress_bar(i / 100.0, prefix=description)
-        time.sleep(duration / 100)
-    print()
+def print_output_summary(outputs):
+    failed = f", {outputs['failed']} failed" if outputs["failed"] else ""
+    print(f"Output files: {outputs['written']} written, {outputs['unchanged']} unchanged{failed}")
+
+class AdaptiveLimiter:
+    """AIMD limit on the number of in-flight requests to one endpoint.
+
+    The limit grows by one per window of successful requests while the latency per
+    token stays close to the best seen so far, and is cut when latency rises (the
+    server is queueing internally) or a request fails or times out.
+    """
+
+    def __init__(self, url, max_limit):
+        self.url = url
+        self.max_limit = max_limit
+        self.limit = float(min(API_INITIAL_CONCURRENCY, max_limit))
+        self.peak_limit = self.limit
+        self.in_flight = 0
+        self.baselines = {}
+        self.hold_until = 0.0
+        self.retry_at = 0.0
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.failures = 0
+        self.tokens = 0
+        self.latency_total = 0.0
+
+    def has_capacity(self, now):
+        return self.in_flight < int(self.limit) and now >= self.retry_at
+
+    def update(self, latency, ok, tokens, model=None):
+        self.requests += 1
+        now = time.time()
+        if not ok:
+            self.failures += 1
+            self.consecutive_failures += 1
+            # Keep an unreachable or overloaded endpoint out of rotation for a while.
+            self.retry_at = now + min(30.0, 0.5 * 2 ** self.consecutive_failures)
+            self._decrease(API_BACKOFF, now, latency)
+            return
+
+        self.consecutive_failures = 0
+        self.tokens += tokens
+        self.latency_total += latency
+        per_token = latency / max(tokens, 1)
+        # Models on the same endpoint differ in speed, so each has its own baseline.
+        baseline = self.baselines.get(model)
+        if baseline is None or per_token < baseline:
+            baseline = per_token
+        else:
+            # Drift slowly so the baseline follows lasting changes on the server.
+            baseline += (per_token - baseline) * 0.01
+        self.baselines[model] = baseline
+
+        if per_token > baseline * API_LATENCY_TOLERANCE:
+            self._decrease(0.9, now, latency)
+        elif self.in_flight + 1 >= int(self.limit):
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.peak_limit = max(self.peak_limit, self.limit)
+
+    def _decrease(self, factor, now, latency):
+        # Responses already in flight saw the same congestion; back off once per round trip.
+        if now < self.hold_until:
+            return
+        self.limit = max(1.0, self.limit * factor)
+        self.hold_until = now + latency
+
+class EndpointPool:
+    """Spread requests over endpoints, each with its own adaptive concurrency limit."""
+
+    def __init__(self, urls, max_limit):
+        self.start_time = time.time()
+        self.condition = threading.Condition()
+        self.limiters = [AdaptiveLimiter(url, max_limit) for url in urls]
+        self.latencies = collections.deque(maxlen=500)
+
+    def acquire_hedge(self, exclude):
+        """Take a slot for a hedged request on the least loaded endpoint other than exclude.
+
+        Hedges are bounded by the hedging budget rather than the concurrency limit, since
+        in a busy run every endpoint is at its limit. Returns None if no endpoint is usable.
+        """
+        with self.condition:
+            now = time.time()
+            usable = [limiter for limiter in self.limiters if limiter is not exclude and now >= limiter.retry_at]
+            if not usable:
+                return None
+            limiter = min(usable, key=lambda l: l.in_flight / l.limit)
+            limiter.in_flight += 1
+            return limiter
+
+    def record_latency(self, latency, chunk):
+        self.latencies.append(latency / max(count_tokens(chunk), 1))
+
+    def hedge_delay(self, chunk):
+        """How long to wait for a chunk before hedging it: the running p95 latency scaled to its size."""
+        samples = sorted(self.latencies)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        percentile = samples[min(len(samples) - 1, int(len(samples) * HEDGE_PERCENTILE))]
+        return max(HEDGE_MIN_DELAY, percentile * max(count_tokens(chunk), 1))
+
+    def urls(self):
+        """Endpoint URLs, those with the most free capacity first."""
+        with self.condition:
+            now = time.time()
+            ranked = sorted(self.limiters, key=lambda l: (not l.has_capacity(now), l.in_flight - l.limit))
+            return [limiter.url for limiter in ranked]
+
+    def acquire(self, url=None):
+        """Take a slot on the endpoint with the most free capacity, or on url if given."""
+        with self.condition:
+            while True:
+                now = time.time()
+                free = [limiter for limiter in self.limiters if url in (None, limiter.url) and limiter.has_capacity(now)]
+                if free:
+                    limiter = max(free, key=lambda l: l.limit - l.in_flight)
+                    limiter.in_flight += 1
+                    return limiter
+                cooling = [limiter.retry_at - now for limiter in self.limiters if limiter.retry_at > now]
+                self.condition.wait(min(cooling) if cooling else None)
+
+    def cancel(self, limiter):
+        """Give back a slot that was not used, without counting it as a request."""
+        with self.condition:
+            limiter.in_flight -= 1
+            self.condition.notify_all()
+
+    def release(self, limiter, latency, ok, tokens=0, model=None):
+        with self.condition:
+            limiter.in_flight -= 1
+            limiter.update(latency, ok, tokens, model)
+            self.condition.notify_all()
+
+    def print_report(self):
+        elapsed_time = time.time() - self.start_time
+        print("Endpoint report:")
+        for limiter in self.limiters:
+            chunks_per_second = (limiter.requests - limiter.failures) / elapsed_time if elapsed_time else 0
+            tokens_per_second = limiter.tokens / elapsed_time if elapsed_time else 0
+            average_latency = limiter.latency_total / max(limiter.requests - limiter.failures, 1)
+            print(f"  {limiter.url}: limit {limiter.limit:.1f} (peak {limiter.peak_limit:.1f}), "
+                  f"{limiter.requests} requests, {limiter.failures} failed, "
+                  f"avg latency {average_latency:.2f}s, {chunks_per_second:.2f} chunks/s, {tokens_per_second:.0f} tokens/s")
+
+class TokenBucket:
+    """Refill at rate units per second up to capacity; rate None means unlimited, 0 paused.
+
+    A take larger than the capacity waits for a full bucket and leaves it in debt, so
+    oversized requests still go through at the configured average rate.
+    """
+
+    def __init__(self):
+        self.rate = None
+        self.capacity = 0.0
+        self.level = 0.0
+        self.updated = time.time()
+
+    def configure(self, rate, capacity, now):
+        self.refill(now)
+        if rate != self.rate:
+            self.level = capacity if self.rate is None else min(self.level, capacity)
+            self.rate = rate
+            self.capacity = capacity
+
+    def refill(self, now):
+        if self.rate:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        needed = min(amount, self.capacity)
+        if self.rate is None or self.level >= needed:
+            return 0.0
+        if not self.rate:
+            return float("inf")
+        return (needed - self.level) / self.rate
+
+    def take(self, amount):
+        if self.rate is not None:
+            self.level = min(self.capacity, self.level - amount)
+
+def parse_hours(hours):
+    """Parse "HH:MM-HH:MM" into minutes of the day; the range may wrap around midnight."""
+    start, end = hours.split("-")
+    return tuple(int(part.split(":")[0]) * 60 + int(part.split(":")[1] if ":" in part else 0) for part in (start, end))
+
+class RateLimiter:
+    """Token-bucket caps on requests per second and estimated tokens per minute, per endpoint.
+
+    Limits come from a JSON file of rules applied in order, later matching rules
+    overriding earlier ones. A rule may be restricted to one endpoint and to a range of
+    local time:
+
+        {"rules": [
+            {"requests_per_second": 4, "tokens_per_minute": 60000},
+            {"hours": "08:00-19:00", "requests_per_second": 1, "tokens_per_minute": 12000},
+            {"endpoint": "http://gpu2:11434", "hours": "08:00-19:00", "requests_per_second": 0.2}
+        ]}
+
+    A missing or null limit means unlimited, and 0 pauses the endpoint until the limit
+    changes. The file is read again when it changes or after reload() (called on
+    SIGHUP), so limits can be adjusted during a run.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.condition = threading.Condition()
+        self.rules = []
+        self.mtime = None
+        self.checked_at = 0.0
+        self.reload_requested = False
+        self.buckets = {}
+        self.current = {}
+        self.waited = collections.defaultdict(float)
+        self._load()
+
+    def reload(self):
+        # Called from a signal handler, so it must not take the lock.
+        self.reload_requested = True
+
+    def _load(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, "r", encoding="utf-8") as f:
+                rules = json.load(f).get("rules", [])
+            for rule in rules:
+                rule["minutes"] = parse_hours(rule["hours"]) if rule.get("hours") else None
+                rule["endpoint"] = rule["endpoint"].rstrip("/") if rule.get("endpoint") else None
+        except (OSError, ValueError, KeyError, IndexError, AttributeError) as e:
+            print(f"Cannot load rate limits from {self.path}, keeping the previous limits: {e}")
+            return
+        if self.mtime is not None:
+            print(f"Rate limits reloaded from {self.path}")
+        self.rules = rules
+        self.mtime = mtime
+
+    def _refresh(self, now):
+        if not self.reload_requested and now - self.checked_at < RATE_LIMITS_CHECK_INTERVAL:
+            return
+        self.checked_at = now
+        try:
+            changed = os.path.getmtime(self.path) != self.mtime
+        except OSError:
+            changed = False
+        if changed or self.reload_requested:
+            self.reload_requested = False
+            self._load()
+
+    def limits(self, url, now):
+        local_time = time.localtime(now)
+        minute = local_time.tm_hour * 60 + local_time.tm_min
+        limits = dict.fromkeys(RATE_LIMIT_KEYS)
+        for rule in self.rules:
+            if rule["endpoint"] not in (None, url.rstrip("/")):
+                continue
+            if rule["minutes"]:
+                start, end = rule["minutes"]
+                if not (start <= minute < end if start <= end else minute >= start or minute < end):
+                    continue
+            limits.update({key: rule[key] for key in RATE_LIMIT_KEYS if key in rule})
+        return limits
+
+    def _buckets(self, url, now):
+        buckets = self.buckets.setdefault(url, {key: TokenBucket() for key in RATE_LIMIT_KEYS})
+        limits = self.limits(url, now)
+        if limits != self.current.get(url):
+            self.current[url] = limits
+            print(f"Rate limits for {url}: {self.describe(limits)}")
+        for key, limit in limits.items():
+            rate = (limit / 60.0 if key == "tokens_per_minute" else float(limit)) if limit is not None else None
+            buckets[key].configure(rate, max(1.0, rate * RATE_LIMIT_BURST[key]) if rate else 0.0, now)
+        return buckets
+
+    @staticmethod
+    def describe(limits):
+        return ", ".join(f"unlimited {key.split('_per_')[0]}" if limits[key] is None
+                         else f"paused {key.split('_per_')[0]}" if not limits[key]
+                         else f"{limits[key]} {key.replace('_per_', '/').replace('_', ' ')}"
+                         for key in RATE_LIMIT_KEYS)
+
+    def _wait_time(self, url, amounts, now):
+        buckets = self._buckets(url, now)
+        return max(buckets[key].wait_time(amounts[key]) for key in RATE_LIMIT_KEYS)
+
+    def acquire(self, urls, tokens, block=True):
+        """Wait until one of urls may take one more request of about tokens tokens, count it and return that url.
+
+        Earlier urls are preferred. Without block, return None instead of waiting.
+        """
+        start_time = time.time()
+        amounts = {"requests_per_second": 1, "tokens_per_minute": tokens}
+        with self.condition:
+            while True:
+                now = time.time()
+                self._refresh(now)
+                delays = {url: self._wait_time(url, amounts, now) for url in urls}
+                url = next((url for url in urls if delays[url] <= 0), None)
+                if url is not None:
+                    for key, bucket in self.buckets[url].items():
+                        bucket.take(amounts[key])
+                    break
+                if not block:
+                    return None
+                # Wake up at least every check interval to pick up new limits.
+                self.condition.wait(min(min(delays.values()), RATE_LIMITS_CHECK_INTERVAL))
+            waited = time.time() - start_time
+            self.waited[url] += waited
+        phase_timer.add("rate limit", waited)
+        return url
+
+    def settle(self, url, tokens):
+        """Correct the token estimate of a finished request by the actual difference."""
+        with self.condition:
+            self.buckets[url]["tokens_per_minute"].take(tokens)
+            self.condition.notify_all()
+
+    def print_report(self):
+        print(f"Rate limits ({self.path}):")
+        for url, limits in self.current.items():
+            print(f"  {url}: {self.describe(limits)}, waited {self.waited[url]:.2f}s")
+
+class ChunkScheduler:
+    """Translate chunks on a worker pool, translating each identical chunk only once per run.
+
+    Work items are keyed by the chunk text and the language pair. A duplicate that is
+    submitted while the original is still in flight shares the same future, and one
+    submitted after it completed gets the stored result without another request.
+    Requests are spread over the endpoints in api_urls under an adaptive limit each.
+
+    Queued items are taken in order of their priority tuple (lowest first); a duplicate
+    submitted with a better priority than the queued original moves it forward.
+    Only the cache_size most recently used translated chunks are kept for reuse, so
+    memory follows the work in flight rather than the size of the tree.
+    A chunk may be submitted with its own prompt set, as the batches of i18n mode are.
+    With rate_limits, requests also wait for the request and token budgets of a RateLimiter.
+
+    With a fast_model, chunks that chunk_tier() finds easy are sent to it instead of the
+    model, and escalated to the model if the fast translation fails validation.
+    """
+
+    def __init__(self, client, workers=None, api_urls=None, model=None, temperature=None, max_tokens=None,
+                 chunk_tokens=None, prompt_set=None, validate=True, hedge_budget=0.0, backend=None, request_log=None, rate_limits=None, fast_model=None,
+                 cache_size=None):
+        workers = workers or API_WORKERS
+        api_urls = api_urls or [API_URL]
+        self.client = client
+        self.model = model
+        self.fast_model = fast_model
+        self.temperature = temperature
+        self.max_tokens = max_tokens or API_MAX_TOKENS
+        self.chunk_tokens = chunk_tokens or self.max_tokens
+        self.prompt_set = prompt_set
+        self.num_ctx = run_context_size(self.chunk_tokens, self.max_tokens, prompt_set)
+        self.validate = validate
+        self.hedge_budget = hedge_budget
+        self.backend = backend
+        self.request_log = open(request_log, "a", encoding="utf-8") if request_log else None
+        self.endpoints = EndpointPool(api_urls, workers)
+        self.rate_limiter = RateLimiter(rate_limits) if rate_limits else None
+        self.queue = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers * len(api_urls))]
+        for thread in self.threads:
+            thread.start()
+        # Abandoned hedge losers keep their thread until they return, hence the headroom.
+        self.hedge_executor = ThreadPoolExecutor(max_workers=2 * len(self.threads)) if hedge_budget else None
+        self.lock = threading.Lock()
+        self.tasks = {}
+        self.pending = {}
+        self.queued_at = {}
+        self.submitted = 0
+        self.deduplicated = 0
+        self.truncated = 0
+        self.retranslated = 0
+        self.requests_sent = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.server_time = {"load": 0.0, "prompt_eval": 0.0, "eval": 0.0, "total": 0.0, "wall": 0.0}
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.validation_problems = {}
+        self.translation_time = 0.0
+        self.tiers = {tier: {"chunks": 0, "requests": 0, "time": 0.0} for tier in ROUTING_TIERS}
+        self.escalated = 0
+        self.skipped_files = 0
+        self.skipped_chunks = 0
+        self.cache_size = cache_size or CHUNK_CACHE_SIZE
+        self.completed = collections.OrderedDict()
+        self.stopping = False
+
+    @staticmethod
+    def chunk_key(chunk, base_lang, target_lang, digest=None):
+        digest = digest or hashlib.sha256(chunk.encode("utf-8")).digest()
+        return (digest, base_lang, target_lang)
+
+    def lookup(self, digest, base_lang, target_lang, priority=()):
+        """Return the future of an already submitted chunk by its digest, or None if it is new."""
+        with self.lock:
+            future = self.tasks.get((digest, base_lang, target_lang))
+        if future is None:
+            return None
+        return self.submit(None, base_lang, target_lang, priority, digest)
+
+    def submit(self, chunk, base_lang, target_lang, priority=(), digest=None, prompt_set=None):
+        key = self.chunk_key(chunk, base_lang, target_lang, digest)
+        with self.lock:
+            self.submitted += 1
+            future = self.tasks.get(key)
+            if future is not None:
+                self.deduplicated += 1
+                if key in self.completed:
+                    self.completed.move_to_end(key)
+                elif key in self.pending and not future.running() and priority < self.pending[key][0]:
+                    # Requeue with the original's text; a lookup() duplicate has none.
+                    _, chunk, prompt_set = self.pending[key]
+                    self.pending[key] = (priority, chunk, prompt_set)
+                    self.queue.put((priority, next(self.sequence), future, chunk, base_lang, target_lang, prompt_set))
+                return future
+            if chunk is None:
+                self.submitted -= 1
+                return None
+            future = Future()
+            self.tasks[key] = future
+            self.pending[key] = (priority, chunk, prompt_set)
+            self.queued_at[future] = time.perf_counter()
+            self.queue.put((priority, next(self.sequence), future, chunk, base_lang, target_lang, prompt_set))
+        future.add_done_callback(lambda done: self._completed(key, done))
+        return future
 
-def scan_directory(input_dir):
-    """Scan the directory and count the total number of markdown files."""
-    all_files = []
-    for root, dirs, files in os.walk(input_dir):
+    def pass_through(self, text, whole_file=False):
+        """Return a finished future for content that is kept as it is, counting it as skipped."""
+        with self.lock:
+            if whole_file:
+                self.skipped_files += 1
+            else:
+                self.skipped_chunks += 1
+        future = Future()
+        future.set_result(text)
+        return future
+
+    def _work(self):
+        while True:
+            _, _, future, chunk, base_lang, target_lang, prompt_set = self.queue.get()
+            if future is None:
+                return
+            with self.lock:
+                # A promoted item is queued twice; whichever copy comes out first runs it.
+                if future.running() or future.done():
+                    continue
+                if not self.stopping:
+                    future.set_running_or_notify_cancel()
+                    phase_timer.add("queue wait", time.perf_counter() - self.queued_at.pop(future))
+            if not future.running():
+                # Shutting down: the chunk is dropped instead of sent. Its callbacks take
+                # the lock, so it is cancelled outside of it.
+                future.cancel()
+                continue
+            try:
+                future.set_result(self._translate(chunk, base_lang, target_lang, prompt_set))
+            except Exception as e:
+                future.set_exception(e)
+
+    def _translate(self, chunk, base_lang, target_lang, prompt_set=None):
+        """Translate a chunk, retranslating it alone while it fails validation."""
+        check = validate_batch if prompt_set == I18N_PROMPT_SET else validate_translation
+        tier = chunk_tier(chunk) if self.fast_model else "large"
+        with self.lock:
+            self.tiers[tier]["chunks"] += 1
+        best = None
+        for attempt in range(VALIDATION_RETRIES + 1 if self.validate else 1):
+            translated_chunk = self._request(chunk, base_lang, target_lang, prompt_set, tier)
+            with phase_timer.phase("post-process"):
+                problems = check(chunk, translated_chunk, base_lang, target_lang) if self.validate else []
+            if best is None or len(problems) < len(best[1]):
+                best = (translated_chunk, problems)
+            if not problems:
+                break
+            with self.lock:
+                self.retranslated += 1
+                if tier == "fast":
+                    self.escalated += 1
+            tier = "large"
+        if best[1]:
+            with self.lock:
+                self.validation_problems[self.chunk_key(chunk, base_lang, target_lang)] = best[1]
+        return best[0]
+
+    def _request(self, chunk, base_lang, target_lang, prompt_set=None, tier="large"):
+        model = self.fast_model if tier == "fast" else self.model
+        for attempt in range(API_RETRIES + 1):
+            url = None
+            if self.rate_limiter:
+                # Requests waiting for the rate budget do not hold an endpoint slot, so the
+                # adaptive limit only sees requests that are actually in flight.
+                url = self.rate_limiter.acquire(self.endpoints.urls(), self._estimated_tokens(chunk, base_lang, target_lang, prompt_set))
+            limiter = self.endpoints.acquire(url)
+            try:
+                if self.hedge_executor:
+                    result = self._send_hedged(limiter, chunk, base_lang, target_lang, prompt_set, model)
+                else:
+                    result = self._send(limiter, chunk, base_lang, target_lang, prompt_set, model)
+            except (requests.exceptions.RequestException, ValueError, KeyError):
+                if attempt == API_RETRIES:
+                    raise
+                continue
+            with self.lock:
+                self.tiers[tier]["requests"] += 1
+                self.tiers[tier]["time"] += result["elapsed"]
+                self.translation_time += result["elapsed"]
+                self.input_tokens += count_tokens(chunk)
+                self.output_tokens += result["output_tokens"]
+                if result["finish_reason"] == "length":
+                    self.truncated += 1
+            return result["content"]
+
+    def _estimated_tokens(self, chunk, base_lang, target_lang, prompt_set=None):
+        """Tokens of a request for the rate limits: its prompts and chunk, and an output about as long as the chunk."""
+        prompts = PROMPT_SETS[prompt_set or self.prompt_set or "default"](lang_dict.get(base_lang, base_lang),
+                                                                          lang_dict.get(target_lang, target_lang))
+        return sum(count_tokens(prompt) for prompt in prompts) + 2 * count_tokens(chunk)
+
+    def _send(self, limiter, chunk, base_lang, target_lang, prompt_set=None, model=None):
+        """Send one request on a slot already taken from limiter, and give the slot back.
+
+        With rate limits, the request's budget must already have been taken for limiter.url.
+        """
+        with self.lock:
+            self.requests_sent += 1
+        start_time = time.time()
+        try:
+            with phase_timer.phase("http"):
+                result = request_translation(chunk, base_lang, target_lang, self.client, limiter.url,
+                                             model or self.model, self.temperature, self.max_tokens, prompt_set or self.prompt_set,
+                                             self.backend, self.num_ctx)
+        except (requests.exceptions.RequestException, ValueError, KeyError):
+            self.endpoints.release(limiter, time.time() - start_time, False)
+            raise
+        self.endpoints.release(limiter, result["elapsed"], True, result["output_tokens"], model or self.model)
+        if self.rate_limiter:
+            self.rate_limiter.settle(limiter.url, result["output_tokens"] - count_tokens(chunk))
+        self.endpoints.record_latency(result["elapsed"], chunk)
+        if "server" in result:
+            self._record_server_timing(limiter.url, model or self.model, result)
+        return result
+
+    def _record_server_timing(self, api_url, model, result):
+        server = result["server"]
+        with self.lock:
+            # Later requests keep a context that had to grow, so the model is not reloaded again.
+            self.num_ctx = max(self.num_ctx, server["num_ctx"])
+            for phase in ("load", "prompt_eval", "eval", "total"):
+                self.server_time[phase] += server[phase]
+            self.server_time["wall"] += result["elapsed"]
+            if self.request_log:
+                self.request_log.write(json.dumps({"endpoint": api_url, "model": model, "elapsed": round(result["elapsed"], 4), **server}) + "\n")
+                self.request_log.flush()
+
+    def _send_hedged(self, limiter, chunk, base_lang, target_lang, prompt_set=None, model=None):
+        """Send a request and, if it outlives the p95 latency, race a duplicate on another endpoint.
+
+        The first successful answer wins. The loser cannot be interrupted mid-request, so
+        it is abandoned: its result is discarded and its endpoint slot is released when
+        it returns.
+        """
+        primary = self.hedge_executor.submit(self._send, limiter, chunk, base_lang, target_lang, prompt_set, model)
+        delay = self.endpoints.hedge_delay(chunk)
+        if delay is None or wait([primary], timeout=delay).done:
+            return primary.result()
+        with self.lock:
+            allowed = self.hedged < self.hedge_budget * self.requests_sent
+        hedge_limiter = self.endpoints.acquire_hedge(limiter) if allowed else None
+        if hedge_limiter and self.rate_limiter and not self.rate_limiter.acquire(
+                [hedge_limiter.url], self._estimated_tokens(chunk, base_lang, target_lang, prompt_set), block=False):
+            # A hedge is only worth sending while the other endpoint has budget to spare.
+            self.endpoints.cancel(hedge_limiter)
+            hedge_limiter = None
+        if hedge_limiter is None:
+            return primary.result()
+        with self.lock:
+            self.hedged += 1
+        hedge = self.hedge_executor.submit(self._send, hedge_limiter, chunk, base_lang, target_lang, prompt_set, model)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self.lock:
+                            self.hedge_wins += 1
+                    return future.result()
+        return primary.result()
+
+    def stats(self):
+        """Snapshot of the counters, so callers can report what a single run added."""
+        with self.lock:
+            return {
+                "submitted": self.submitted,
+                "deduplicated": self.deduplicated,
+                "truncated": self.truncated,
+                "retranslated": self.retranslated,
+                "requests": self.requests_sent,
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "translation_time": self.translation_time,
+                "escalated": self.escalated,
+                "skipped_files": self.skipped_files,
+                "skipped_chunks": self.skipped_chunks,
+                **{f"{tier}_{key}": value for tier, counts in self.tiers.items() for key, value in counts.items()},
+                **{f"server_{phase}": seconds for phase, seconds in self.server_time.items()},
+            }
+
+    def _completed(self, key, future):
+        with self.lock:
+            if self.tasks.get(key) is not future:
+                return
+            del self.pending[key]
+            if future.cancelled() or future.exception() is not None:
+                # A failed item must not poison later duplicates; they get a fresh attempt.
+                del self.tasks[key]
+                self.queued_at.pop(future, None)
+                return
+            self.completed[key] = None
+            while len(self.completed) > self.cache_size:
+                evicted, _ = self.completed.popitem(last=False)
+                del self.tasks[evicted]
+
+    def shutdown(self):
+        """Stop the worker threads. Chunks still queued are cancelled rather than sent, so an
+        interrupted run stops after the requests already in flight."""
+        with self.lock:
+            self.stopping = True
+        while True:
+            try:
+                future = self.queue.get_nowait()[2]
+            except queue.Empty:
+                break
+            if future is not None:
+                future.cancel()
+        for _ in self.threads:
+            self.queue.put(((float("inf"),), next(self.sequence), None, None, None, None, None))
+        for thread in self.threads:
+            thread.join()
+        if self.hedge_executor:
+            self.hedge_executor.shutdown(wait=False)
+        if self.request_log:
+            self.request_log.close()
+            self.request_log = None
+
+class FileJob:
+    """A file whose chunks are being translated by a ChunkScheduler.
+
+    Jobs only live until their file is written; digests are packed into one bytes object.
+    """
+
+    __slots__ = ("input_path", "output_path", "futures", "digests", "remaining", "lock", "ready")
+
+    def __init__(self, input_path, output_path, futures, ready, digests=()):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.futures = futures
+        self.digests = b"".join(digests)
+        self.remaining = len(futures)
+        self.lock = threading.Lock()
+        self.ready = ready
+        if not futures:
+            ready.put(self)
+        for future in futures:
+            future.add_done_callback(self._chunk_done)
+
+    def _chunk_done(self, future):
+        with self.lock:
+            self.remaining -= 1
+            finished = self.remaining == 0
+        if finished:
+            self.ready.put(self)
+
+    def result(self):
+        return ''.join(future.result() for future in self.futures)
+
+def iter_files(input_dir, extensions=(".md",)):
+    """Yield the markdown files (or files with the given extensions) below input_dir while walking it."""
+    walk = os.walk(input_dir)
+    while True:
+        # Only the walk itself is timed, not the work done on each file between steps.
+        with phase_timer.phase("scan"):
+            step = next(walk, None)
+        if step is None:
+            return
+        root, dirs, files = step
         for file in files:
-            if file.endswith(".md"):
-                all_files.append(os.path.join(root, file))
-    return all_files
+            if file.endswith(extensions):
+                yield os.path.join(root, file)
+
+def scan_directory(input_dir, extensions=(".md",)):
+    """Scan the directory and count the total number of markdown files (or files with the given extensions)."""
+    return list(iter_files(input_dir, extensions))
+
+class FileList:
+    """Compact list of file paths and sizes, for runs that must see every file before starting.
+
+    Each directory name is stored once, file names are packed into one byte string, and
+    offsets and sizes live in arrays, so a million paths take tens of megabytes rather
+    than hundreds.
+    """
+
+    __slots__ = ("directories", "directory_ids", "directory_of", "names", "name_ends", "sizes")
 
-def process_directory(input_dir, output_dir, base_lang, target_lang, recursive, client):
+    def __init__(self, paths=()):
+        self.directories = []
+        self.directory_ids = {}
+        self.directory_of = array.array("I")
+        self.names = bytearray()
+        self.name_ends = array.array("Q")
+        self.sizes = array.array("Q")
+        for path in paths:
+            try:
+                self.append(path)
+            except OSError:
+                # A dangling symlink, or a file deleted since it was listed.
+                print(f"Input file not found: {path}")
+
+    def append(self, path, size=None):
+        if size is None:
+            size = os.path.getsize(path)
+        directory, name = os.path.split(path)
+        directory_id = self.directory_ids.get(directory)
+        if directory_id is None:
+            directory_id = self.directory_ids[directory] = len(self.directories)
+            self.directories.append(directory)
+        self.directory_of.append(directory_id)
+        self.names += name.encode("utf-8", "surrogateescape")
+        self.name_ends.append(len(self.names))
+        self.sizes.append(size)
+
+    def __len__(self):
+        return len(self.name_ends)
+
+    def __getitem__(self, index):
+        start = self.name_ends[index - 1] if index else 0
+        name = self.names[start:self.name_ends[index]].decode("utf-8", "surrogateescape")
+        return os.path.join(self.directories[self.directory_of[index]], name)
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+
+    def select(self, indexes):
+        """A new FileList with the entries at indexes, in that order."""
+        selected = FileList()
+        for index in indexes:
+            selected.append(self[index], self.sizes[index])
+        return selected
+
+def priority_rank(file_path, input_dir, priority_globs):
+    """Return the index of the first priority glob matching the file, or len(priority_globs)."""
+    relative_path = os.path.relpath(file_path, input_dir)
+    for rank, pattern in enumerate(priority_globs):
+        if fnmatch.fnmatch(relative_path, pattern) or fnmatch.fnmatch(file_path, pattern):
+            return rank
+    return len(priority_globs)
+
+def order_files(all_files, input_dir, policy, priority_globs):
+    """Order a FileList so the most valuable files are read, queued and finished first."""
+    ranks = array.array("I", (priority_rank(path, input_dir, priority_globs) for path in all_files))
+    if policy == "shortest":
+        return all_files.select(sorted(range(len(all_files)), key=lambda index: (ranks[index], all_files.sizes[index])))
+    return all_files.select(sorted(range(len(all_files)), key=ranks.__getitem__))
+
+def chunk_priority(policy, rank, file_index, chunk_count, chunk_index):
+    if policy == "shortest":
+        return (rank, chunk_count, file_index, chunk_index)
+    if policy == "round-robin":
+        return (rank, chunk_index, file_index)
+    return (rank, file_index, chunk_index)
+
+def parse_shard(value):
+    """Parse the "i/N" of --shard, with shards numbered from 1."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {value!r}")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"shard index must be between 1 and {count}, got {index}")
+    return index, count
+
+def shard_files(all_files, input_dir, shard):
+    """Return the files of shard (index, count), in their original order.
+
+    Files are assigned largest first to the shard with the fewest estimated tokens so
+    far (longest processing time first). The order only depends on file sizes and
+    relative paths, so every runner computes the same split without coordination.
+    """
+    index, count = shard
+    if not isinstance(all_files, FileList):
+        all_files = FileList(all_files)
+    loads = [(0, shard_index) for shard_index in range(1, count + 1)]
+    order = sorted(range(len(all_files)), key=lambda i: (-all_files.sizes[i], os.path.relpath(all_files[i], input_dir).replace(os.sep, "/")))
+    selected = []
+    for file_index in order:
+        load, shard_index = heapq.heappop(loads)
+        if shard_index == index:
+            selected.append(file_index)
+        heapq.heappush(loads, (load + all_files.sizes[file_index] // 4, shard_index))
+    return all_files.select(sorted(selected))
+
+def get_output_path(file_path, input_dir, output_dir, target_lang):
+    relative_path = os.path.relpath(file_path, input_dir)
+    if output_dir:
+        return os.path.join(output_dir, relative_path.replace(".md", f".{target_lang}.md"))
+    return file_path.replace(".md", f".{target_lang}.md")
+
+def get_i18n_output_path(file_path, input_dir, output_dir, base_lang, target_lang):
+    """name.{lang}.ext, or {lang}.ext for files named after their language such as en.json."""
+    directory, name = os.path.split(os.path.relpath(file_path, input_dir))
+    stem, extension = os.path.splitext(name)
+    name = f"{target_lang}{extension}" if stem == base_lang else f"{stem}.{target_lang}{extension}"
+    return os.path.join(output_dir or input_dir, directory, name)
+
+def is_i18n_output(file_path, base_lang):
+    """True for locale files named after another language, such as de.json or messages.de.po."""
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    lang = stem.rsplit(".", 1)[-1]
+    return lang in lang_dict and lang != base_lang
+
+def process_directory(input_dir, output_dir, base_lang, target_lang, recursive, client, workers=None, api_urls=None,
+                      policy="fifo", priority_globs=(), scheduler=None, cpu_workers=None, validation_report=None,
+                      history_file=None, shard=None, metrics_file=None, language_check=True):
     # Scan folders and show the number of files
-    
-    print("Scanning directory for markdown files...")
+    run_start_time = time.time()
+
+    if shard or policy != "fifo" or priority_globs:
+        print("Scanning directory for markdown files...")
+        with phase_timer.phase("scan"):
+            all_files = FileList(iter_files(input_dir))
+        print(f"Total markdown files found: {len(all_files)}")
+        if shard:
+            all_files = shard_files(all_files, input_dir, shard)
+            print(f"Shard {shard[0]}/{shard[1]}: {len(all_files)} files, ~{sum(all_files.sizes) // 4} estimated tokens")
+        if policy != "fifo" or priority_globs:
+            all_files = order_files(all_files, input_dir, policy, priority_globs)
+    else:
+        # In directory order, files are translated while the tree is still being walked.
+        print("Scanning directory for markdown files while translating...")
+        all_files = iter_files(input_dir)
+
+    owns_scheduler = scheduler is None
+    if owns_scheduler:
+        scheduler = ChunkScheduler(client, workers, api_urls)
+    stats_before = scheduler.stats()
+    ready = queue.Queue()
+    outputs = collections.Counter()
+    created_dirs = set()
+    failures = []
+    counts = {"queued": 0, "done": 0, "chunks": 0}
+
+    def finish(job):
+        counts["done"] += 1
+        counts["chunks"] -= len(job.futures)
+        display_progress_bar(counts["done"] / counts["queued"], prefix='Processing files', suffix=f"{counts['done']}/{counts['queued']}")
+        print()
+        try:
+            with phase_timer.phase("post-process"):
+                translated_text = job.result()
+        except Exception as e:
+            print(f"Translation failed for {job.input_path}: {e}")
+            return
+        finally:
+            # Futures still pending for other files hold this job in their callbacks;
+            # dropping its futures keeps that from chaining finished files together.
+            job.futures = ()
+        with phase_timer.phase("write"):
+            outputs[write_translation(job.output_path, translated_text, created_dirs)] += 1
+        failures.extend(validation_failures(job, scheduler, base_lang, target_lang))
+
+    start_time = time.time()
+    descriptors = preprocess_files(all_files, scheduler.chunk_tokens, cpu_workers)
+    for file_index, (file_path, length, spans, timings) in enumerate(descriptors):
+        if length is None:
+            print(spans)
+            continue
+        phase_timer.add("read", timings[0], timings[1])
+        phase_timer.add("split", timings[2], timings[3])
+        rank = priority_rank(file_path, input_dir, priority_globs)
+        # Chunk texts are only read back for chunks the scheduler has not seen yet.
+        file_content = None
+        futures = []
+        # A file is only copied as a whole if none of its chunks needs translating.
+        whole_file = language_check and all(already_translated(span[3], target_lang) for span in spans)
+        if whole_file:
+            with phase_timer.phase("read"):
+                file_content = read_source_file(file_path) or ""
+            if len(file_content) == length:
+                futures.append(scheduler.pass_through(file_content, whole_file=True))
+            spans = [(0, length, None, None)]
+        for chunk_index, (start, end, digest, chunk_language) in enumerate(() if whole_file else spans):
+            priority = chunk_priority(policy, rank, file_index, len(spans), chunk_index)
+            future = scheduler.lookup(digest, base_lang, target_lang, priority)
+            if future is None:
+                if file_content is None:
+                    with phase_timer.phase("read"):
+                        file_content = read_source_file(file_path) or ""
+                if len(file_content) != length:
+                    break
+                if language_check and already_translated(chunk_language, target_lang):
+                    future = scheduler.pass_through(file_content[start:end])
+                else:
+                    future = scheduler.submit(file_content[start:end], base_lang, target_lang, priority, digest)
+            futures.append(future)
+        if len(futures) != len(spans):
+            print(f"File changed while it was being processed, skipping: {file_path}")
+            continue
+        output_path = get_output_path(file_path, input_dir, output_dir, target_lang)
+        FileJob(file_path, output_path, futures, ready, [digest for _, _, digest, _ in spans if digest])
+        counts["queued"] += 1
+        counts["chunks"] += len(futures)
+        # Files are written as soon as their last chunk is translated. Reading stops
+        # while too many chunks are waiting, so memory follows the work in flight.
+        while counts["chunks"] > MAX_PENDING_CHUNKS or not ready.empty():
+            finish(ready.get())
+
+    print(f"Preprocessing step: {time.time() - start_time:.2f} seconds")
+    while counts["done"] < counts["queued"]:
+        finish(ready.get())
+
+    if owns_scheduler:
+        scheduler.shutdown()
+    stats_after = scheduler.stats()
+    run = {key: stats_after[key] - stats_before[key] for key in stats_after}
+    elapsed_time = time.time() - run_start_time
+    print(f"\nTotal translation time: {run['translation_time']:.2f} seconds")
+    print(f"Chunks: {run['submitted']} submitted, {run['submitted'] - run['deduplicated']} translated, {run['deduplicated']} deduplicated")
+    if language_check:
+        print(f"Already in {target_lang} or without prose, copied without a request: "
+              f"{run['skipped_files']} files, {run['skipped_chunks']} more chunks")
+    print_output_summary(outputs)
+    if run["truncated"]:
+        print(f"Warning: {run['truncated']} chunks hit the output token limit and may be truncated")
+    if scheduler.hedge_executor:
+        print(f"Hedging: {run['hedged']} duplicate requests, {run['hedge_wins']} won")
+    if scheduler.fast_model:
+        print_routing(run, scheduler)
+    print(f"Validation: {run['retranslated']} retranslations, {len(failures)} chunks still failing")
+    if run["server_wall"]:
+        print_server_timing(run)
+    if validation_report:
+        with open(validation_report, "w", encoding="utf-8") as f:
+            json.dump({"base_lang": base_lang, "target_lang": target_lang, "failures": failures}, f, indent=2, ensure_ascii=False)
+        print(f"Validation report saved to {validation_report}")
+    scheduler.endpoints.print_report()
+    if scheduler.rate_limiter:
+        scheduler.rate_limiter.print_report()
+    if history_file and run["input_tokens"]:
+        record_history(history_file, {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "model": scheduler.model or API_MODEL,
+            "base_lang": base_lang,
+            "target_lang": target_lang,
+            "files": counts["done"],
+            "elapsed": round(elapsed_time, 3),
+            **{key: run[key] for key in ("requests", "input_tokens", "output_tokens")},
+        })
+    if metrics_file:
+        write_metrics(metrics_file, {
+            "shard": f"{shard[0]}/{shard[1]}" if shard else None,
+            "model": scheduler.model or API_MODEL,
+            "base_lang": base_lang,
+            "target_lang": target_lang,
+            "files": counts["done"],
+            "elapsed": round(elapsed_time, 3),
+            "outputs": dict(outputs),
+            "failures": failures,
+            **run,
+        })
+    print("\nAll files processed.")
+
+def write_metrics(metrics_file, metrics):
+    try:
+        with open(metrics_file, "w", encoding="utf-8") as f:
+            json.dump(metrics, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"Metrics saved to {metrics_file}")
+    except IOError:
+        print(f"Cannot write to metrics file: {metrics_file}")
+
+def merge_metrics(reports):
+    """Combine per-shard metrics: counters are summed, lists joined, and elapsed is the slowest shard."""
+    merged = {"shards": [report.get("shard") for report in reports]}
+    for report in reports:
+        for key, value in report.items():
+            if key == "shard":
+                continue
+            if key == "elapsed":
+                merged[key] = max(merged.get(key, 0), value)
+            elif isinstance(value, dict):
+                merged[key] = dict(collections.Counter(merged.get(key, {})) + collections.Counter(value))
+            elif isinstance(value, list):
+                merged[key] = merged.get(key, []) + value
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                merged[key] = merged.get(key, 0) + value
+            elif merged.setdefault(key, value) != value:
+                print(f"Warning: shards differ in {key}: {merged[key]!r} and {value!r}")
+    return merged
+
+def collect_batch(strings, future, translations):
+    """Store the usable translations of a batch reply by ID; return the strings that need another try."""
+    try:
+        reply = parse_batch_reply(future.result()) or {}
+    except Exception as e:
+        print(f"Batch translation failed: {e}")
+        reply = {}
+    failed = []
+    for string_id, text in enumerate(strings, 1):
+        translated = reply.get(str(string_id))
+        if string_problem(text, translated):
+            failed.append(text)
+        else:
+            translations[text] = translated
+    return failed
+
+def process_i18n_directory(input_dir, output_dir, base_lang, target_lang, client, workers=None, api_urls=None, scheduler=None):
+    """Translate the string values of JSON, YAML and gettext PO files, many strings per request.
+
+    Only values are sent to the model; keys, structure and order are kept. Identical
+    strings across all files are translated once. Each batch is a JSON object of numbered
+    strings and the reply is mapped back by ID. Strings missing from a reply or with
+    changed placeholders are retranslated one by one, and stay in the source language if
+    that fails too.
+    """
+    run_start_time = time.time()
+
+    print("Scanning directory for locale files...")
+    all_files = [path for path in scan_directory(input_dir, I18N_EXTENSIONS) if not is_i18n_output(path, base_lang)]
+    print(f"Total locale files found: {len(all_files)}")
+
+    owns_scheduler = scheduler is None
+    if owns_scheduler:
+        scheduler = ChunkScheduler(client, workers, api_urls)
+    stats_before = scheduler.stats()
+    documents = []
+    unique = {}
+    total_strings = 0
+    for file_path in all_files:
+        try:
+            file_format, document = read_i18n_file(file_path)
+        except ValueError as e:
+            print(f"Cannot parse {file_path}: {e}")
+            continue
+        documents.append((file_path, file_format, document))
+        for text in i18n_strings(file_format, document):
+            total_strings += 1
+            if is_translatable(text):
+                unique.setdefault(text)
+    batches = pack_batches(list(unique))
+    print(f"Strings: {total_strings} in {len(documents)} files, {len(unique)} unique to translate in {len(batches)} batches")
+
+    translations = {}
+    futures = [(batch, scheduler.submit(batch_payload(batch), base_lang, target_lang, (index,), prompt_set=I18N_PROMPT_SET))
+               for index, batch in enumerate(batches)]
+    retry = []
+    for i, (batch, future) in enumerate(futures):
+        retry += collect_batch(batch, future, translations)
+        display_progress_bar((i + 1) / len(futures), prefix='Translating batches', suffix=f"{i+1}/{len(futures)}")
+    print()
+    futures = [([text], scheduler.submit(batch_payload([text]), base_lang, target_lang, prompt_set=I18N_PROMPT_SET)) for text in retry]
+    untranslated = []
+    for batch, future in futures:
+        untranslated += collect_batch(batch, future, translations)
+
+    outputs = collections.Counter()
+    created_dirs = set()
+    for file_path, file_format, document in documents:
+        output_path = get_i18n_output_path(file_path, input_dir, output_dir, base_lang, target_lang)
+        outputs[write_translation(output_path, render_i18n(file_format, document, translations, target_lang), created_dirs)] += 1
+
+    if owns_scheduler:
+        scheduler.shutdown()
+    stats_after = scheduler.stats()
+    run = {key: stats_after[key] - stats_before[key] for key in stats_after}
+    print(f"\nTotal translation time: {run['translation_time']:.2f} seconds")
+    print(f"Strings: {len(unique)} unique, {total_strings - len(unique)} repeated or without text, "
+          f"{len(retry)} retranslated one by one, {len(untranslated)} left in {lang_dict.get(base_lang, base_lang)}")
+    for text in untranslated[:10]:
+        print(f"  Not translated: {text!r}")
+    print(f"Requests: {run['requests']} for {len(batches)} batches and {len(retry)} single strings")
+    print_output_summary(outputs)
+    if scheduler.fast_model:
+        print_routing(run, scheduler)
+    scheduler.endpoints.print_report()
+    if scheduler.rate_limiter:
+        scheduler.rate_limiter.print_report()
+    print(f"\nAll locale files processed in {time.time() - run_start_time:.2f} seconds.")
+
+def print_routing(run, scheduler):
+    """Per-tier chunk counts and latencies of a run with a fast model."""
+    for tier, model in (("fast", scheduler.fast_model), ("large", scheduler.model or API_MODEL)):
+        average_latency = run[f"{tier}_time"] / run[f"{tier}_requests"] if run[f"{tier}_requests"] else 0
+        print(f"Routing: {tier} tier ({model}): {run[f'{tier}_chunks']} chunks, {run[f'{tier}_requests']} requests, "
+              f"{run[f'{tier}_time']:.2f}s total, avg latency {average_latency:.2f}s")
+    print(f"Routing: {run['escalated']} chunks escalated from the fast tier after failing validation")
+
+def print_server_timing(run):
+    """Split request time into model loading, prompt processing, generation and network/queueing."""
+    other = run["server_total"] - run["server_load"] - run["server_prompt_eval"] - run["server_eval"]
+    network = run["server_wall"] - run["server_total"]
+    generation_rate = run["output_tokens"] / run["server_eval"] if run["server_eval"] else 0
+    print(f"Server timing: load {run['server_load']:.2f}s, prompt processing {run['server_prompt_eval']:.2f}s, "
+          f"generation {run['server_eval']:.2f}s ({generation_rate:.1f} tokens/s), other server time {other:.2f}s, "
+          f"network and queueing {network:.2f}s")
+
+def record_history(history_file, entry):
+    try:
+        with open(history_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+    except IOError:
+        print(f"Cannot write to history file: {history_file}")
+
+def load_history(history_file, model):
+    """Return the most recent history entries for a model, oldest first."""
+    if not history_file or not os.path.exists(history_file):
+        return []
+    entries = []
+    with open(history_file, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get("model") == model and entry.get("elapsed"):
+                entries.append(entry)
+    return entries[-HISTORY_RUNS:]
+
+def format_duration(seconds):
+    hours, remainder = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours}h {minutes:02d}m {seconds:02d}s" if hours else f"{minutes}m {seconds:02d}s"
+
+def plan_directory(input_dir, base_lang, target_lang, model, chunk_tokens, prompt_set=None, cpu_workers=None,
+                   queue_path=None, history_file=None, shard=None, language_check=True):
+    """Estimate the work of a directory run without calling the API.
+
+    Files are split and hashed exactly as a real run would, duplicate chunks are counted
+    once, chunks already translated in a work queue or already in the target language are
+    left out, and the duration is estimated from the input token throughput of previous
+    runs with the same model.
+    """
+    start_time = time.time()
+    done = set()
+    if queue_path:
+        if not os.path.isfile(queue_path):
+            print(f"Work queue not found: {queue_path}")
+            return
+        # Read-only, without JobQueue's pragmas and schema, so planning never changes the
+        # journal mode of a queue or creates one.
+        connection = sqlite3.connect(f"file:{urllib.parse.quote(os.path.abspath(queue_path))}?mode=ro", uri=True)
+        try:
+            done = {bytes.fromhex(digest) for (digest,) in connection.execute(
+                "SELECT digest FROM tasks WHERE status = 'done' AND base_lang = ? AND target_lang = ?", (base_lang, target_lang))}
+        except sqlite3.Error as e:
+            print(f"Cannot read work queue {queue_path}: {e}")
+            return
+        finally:
+            connection.close()
+
     all_files = scan_directory(input_dir)
-    
-    total_files = len(all_files)
-    print(f"Total markdown files found: {total_files}")
+    if shard:
+        all_files = shard_files(all_files, input_dir, shard)
+        print(f"Shard {shard[0]}/{shard[1]}: {len(all_files)} files")
 
-    for i, file_path in enumerate(all_files):
-        progress = (i + 1) / total_files
-        display_progress_bar(progress, prefix='Processing files')
-        relative_path = os.path.relpath(file_path, input_dir)
-        if output_dir:
-            output_path = os.path.join(output_dir, relative_path.replace(".md", f".{target_lang}.md"))
+    files = 0
+    chunks = 0
+    total_tokens = 0
+    unique = {}
+    skipped = collections.Counter()
+    for file_path, length, spans, _ in preprocess_files(all_files, chunk_tokens, cpu_workers):
+        if length is None:
+            print(spans)
+            continue
+        files += 1
+        chunks += len(spans)
+        total_tokens += sum((end - start) // 4 for start, end, _, _ in spans)
+        if language_check and all(already_translated(span[3], target_lang) for span in spans):
+            skipped["files"] += 1
+            continue
+        for start, end, digest, chunk_language in spans:
+            if language_check and already_translated(chunk_language, target_lang):
+                skipped["chunks"] += 1
+            else:
+                unique[digest] = (end - start) // 4
+    pending = {digest: tokens for digest, tokens in unique.items() if digest not in done}
+
+    prompts = PROMPT_SETS[prompt_set or "default"](lang_dict.get(base_lang, base_lang), lang_dict.get(target_lang, target_lang))
+    prompt_tokens = sum(count_tokens(prompt) for prompt in prompts)
+    input_tokens = sum(pending.values())
+    length_ratio = LANGUAGE_LENGTH_FACTORS.get(target_lang, 1.0) / LANGUAGE_LENGTH_FACTORS.get(base_lang, 1.0)
+
+    print(f"Plan for {input_dir} ({base_lang} -> {target_lang}, model {model}):")
+    print(f"  Files: {files}")
+    if language_check:
+        print(f"  Already in {target_lang} or without prose: {skipped['files']} files, {skipped['chunks']} more chunks")
+    print(f"  Chunks: {chunks} total, {len(unique)} unique, {len(unique) - len(pending)} already done in queue, {len(pending)} to translate")
+    print(f"  Tokens: {total_tokens} in source, {input_tokens} to send (+{prompt_tokens * len(pending)} prompt), ~{int(input_tokens * length_ratio)} to generate")
+    print(f"  Requests: {len(pending)}")
+    history = load_history(history_file, model)
+    if history:
+        tokens_per_second = sum(entry["input_tokens"] for entry in history) / sum(entry["elapsed"] for entry in history)
+        print(f"  Estimated duration: {format_duration(input_tokens / tokens_per_second)} "
+              f"(from {len(history)} previous runs at {tokens_per_second:.1f} source tokens/s)")
+    else:
+        print(f"  Estimated duration: unknown (no history for {model} in {history_file})")
+    print(f"Planning step: {time.time() - start_time:.2f} seconds")
+
+
+class PollingWatcher:
+    """Detect changed markdown files by comparing modification times between scans."""
+
+    def __init__(self, input_dir):
+        self.input_dir = input_dir
+        self.snapshot = self.scan()
+
+    def scan(self):
+        snapshot = {}
+        for file_path in scan_directory(self.input_dir):
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            snapshot[file_path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def poll(self, timeout):
+        time.sleep(min(timeout, WATCH_POLL_INTERVAL))
+        snapshot = self.scan()
+        changed = [path for path, state in snapshot.items() if self.snapshot.get(path) != state]
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    """Linux inotify watcher using libc through ctypes, covering every subdirectory."""
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_ISDIR = 0x40000000
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, input_dir):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = {}
+        for root, dirs, files in os.walk(input_dir):
+            self.add_directory(root)
+
+    def add_directory(self, path):
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd >= 0:
+            self.directories[wd] = path
+
+    def poll(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if wd not in self.directories or not name:
+                continue
+            path = os.path.join(self.directories[wd], os.fsdecode(name))
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    self.add_directory(path)
+            elif mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+                changed.append(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+def create_watcher(input_dir):
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(input_dir)
+        except (OSError, AttributeError, TypeError) as e:
+            print(f"inotify unavailable ({e}), falling back to polling")
+    return PollingWatcher(input_dir)
+
+def watch_directory(translator, input_dir, output_dir, base_lang, target_lang, stop_event=None, debounce=WATCH_DEBOUNCE):
+    """Retranslate markdown files shortly after they are saved.
+
+    Saves are debounced per file. Chunks the translator has already seen are reused,
+    so only the chunks that changed are sent to the model.
+    """
+    watcher = create_watcher(input_dir)
+    output_suffix = f".{target_lang}.md"
+    output_root = os.path.abspath(output_dir) + os.sep if output_dir else None
+    pending = {}
+    print(f"\nWatching {input_dir} for changes (Ctrl+C to stop)...")
+    try:
+        while stop_event is None or not stop_event.is_set():
+            for path in watcher.poll(debounce if pending else WATCH_POLL_INTERVAL):
+                # Skip our own outputs, which may live inside the watched tree.
+                if not path.endswith(".md") or path.endswith(output_suffix):
+                    continue
+                if output_root and os.path.abspath(path).startswith(output_root):
+                    continue
+                pending[path] = time.time()
+
+            now = time.time()
+            for path in [path for path, changed_at in pending.items() if now - changed_at >= debounce]:
+                del pending[path]
+                start_time = time.time()
+                submitted, deduplicated = translator.scheduler.submitted, translator.scheduler.deduplicated
+                output_path = get_output_path(path, input_dir, output_dir, target_lang)
+                try:
+                    if not translator.translate_file(path, output_path, base_lang, target_lang):
+                        continue
+                except Exception as e:
+                    print(f"Translation failed for {path}: {e}")
+                    continue
+                submitted = translator.scheduler.submitted - submitted
+                reused = translator.scheduler.deduplicated - deduplicated
+                print(f"Retranslated {path} in {time.time() - start_time:.2f} seconds: "
+                      f"{submitted - reused} changed chunks, {reused} unchanged")
+    finally:
+        watcher.close()
+
+def validation_failures(job, scheduler, base_lang, target_lang):
+    """List the chunks of a job whose final translation still failed validation."""
+    failures = []
+    for chunk_index in range(len(job.digests) // 32):
+        problems = scheduler.validation_problems.get((job.digests[chunk_index * 32:(chunk_index + 1) * 32], base_lang, target_lang))
+        if problems:
+            failures.append({"file": job.input_path, "output": job.output_path, "chunk": chunk_index, "problems": problems})
+    return failures
+
+class Translator:
+    """Importable translation API with explicit configuration.
+
+    One Translator keeps its HTTP session, endpoint limits and the results of chunks it
+    has already translated alive between calls, so repeated jobs skip the start-up cost
+    and any content they have in common:
+
+        translator = Translator(api_urls=["http://gpu1:11434"], model="qwen2:7b")
+        translator.translate_directory("docs", "docs-de", "en", "de")
+        translator.close()
+    """
+
+    def __init__(self, api_urls=None, api_key=None, model=None, temperature=None, max_tokens=None,
+                 workers=None, policy="fifo", priority_globs=(), chunk_tokens=None, prompt_set=None, cpu_workers=None,
+                 validate=True, hedge_budget=0.0, history_file=None, backend=None, request_log=None,
+                 rate_limits=None, fast_model=None, cache_size=None, language_check=True):
+        self.api_urls = list(api_urls or [API_URL])
+        self.backend = backend
+        self.history_file = history_file
+        self.model = model or API_MODEL
+        self.policy = policy
+        self.priority_globs = list(priority_globs)
+        self.cpu_workers = cpu_workers
+        self.language_check = language_check
+        self.client = initialize_api_client(api_key or API_KEY)
+        self.scheduler = ChunkScheduler(self.client, workers, self.api_urls, self.model, temperature, max_tokens,
+                                        chunk_tokens, prompt_set, validate, hedge_budget, backend, request_log, rate_limits,
+                                        fast_model, cache_size)
+
+    @classmethod
+    def from_profile(cls, name, profiles_file=None, **overrides):
+        """Create a Translator from a named model profile; keyword arguments override its settings."""
+        profiles = load_profiles(profiles_file)
+        if name not in profiles:
+            raise ValueError(f"Unknown profile: {name}. Available: {', '.join(profiles)}")
+        settings = {key: profiles[name].get(key) for key in PROFILE_SETTINGS}
+        settings.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(**settings)
+
+    def translate_text(self, text, base_lang, target_lang):
+        spans = split_offsets(text, self.scheduler.chunk_tokens, show_progress=False)
+        if not self.language_check:
+            futures = [self.scheduler.submit(text[start:end], base_lang, target_lang) for start, end in spans]
+            return ''.join(future.result() for future in futures)
+        languages = identify_spans(text, spans)
+        if all(already_translated(language, target_lang) for language in languages):
+            return self.scheduler.pass_through(text, whole_file=True).result()
+        futures = [
+            self.scheduler.pass_through(text[start:end]) if already_translated(chunk_language, target_lang)
+            else self.scheduler.submit(text[start:end], base_lang, target_lang)
+            for (start, end), chunk_language in zip(spans, languages)
+        ]
+        return ''.join(future.result() for future in futures)
+
+    def translate_file(self, input_path, output_path, base_lang, target_lang):
+        file_content = read_source_file(input_path)
+        if file_content is None:
+            return False
+        write_translation(output_path, self.translate_text(file_content, base_lang, target_lang))
+        return True
+
+    def translate_directory(self, input_dir, output_dir, base_lang, target_lang, recursive=True, validation_report=None,
+                            shard=None, metrics_file=None):
+        process_directory(input_dir, output_dir, base_lang, target_lang, recursive, self.client,
+                          policy=self.policy, priority_globs=self.priority_globs, scheduler=self.scheduler,
+                          cpu_workers=self.cpu_workers, validation_report=validation_report,
+                          history_file=self.history_file, shard=shard, metrics_file=metrics_file,
+                          language_check=self.language_check)
+
+    def translate_i18n_directory(self, input_dir, output_dir, base_lang, target_lang):
+        process_i18n_directory(input_dir, output_dir, base_lang, target_lang, self.client, scheduler=self.scheduler)
+
+    def watch_directory(self, input_dir, output_dir, base_lang, target_lang, stop_event=None):
+        watch_directory(self, input_dir, output_dir, base_lang, target_lang, stop_event)
+
+    def warm_up(self, base_lang="en", target_lang="de"):
+        """Send a tiny request to every endpoint so the model is loaded before real work arrives."""
+        for api_url in self.api_urls:
+            try:
+                # Load the model with the context real requests will use.
+                translate_full("Hello.", base_lang, target_lang, self.client, api_url, self.model, max_tokens=16, backend=self.backend,
+                               num_ctx=self.scheduler.num_ctx)
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                print(f"Warm-up failed for {api_url}: {e}")
+
+    def close(self):
+        self.scheduler.shutdown()
+        self.client.close()
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    """JSON API of the daemon.
+
+    POST /translate  {"text", "target_lang", "base_lang"?}  -> {"translation"}
+    POST /jobs       {"input_dir", "target_lang", "output_dir"?, "base_lang"?, "watch"?}  -> {"id", "status"}
+    GET  /jobs/<id>  -> {"id", "status", "error"?}
+    """
+
+    def do_GET(self):
+        job = self.server.jobs.get(self.path.rsplit("/", 1)[-1]) if self.path.startswith("/jobs/") else None
+        if job is None:
+            self.send_json(404, {"error": "not found"})
+            return
+        self.send_json(200, job)
+
+    def do_POST(self):
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not isinstance(payload, dict):
+                raise ValueError("the body must be a JSON object")
+            target_lang = payload["target_lang"]
+            base_lang = payload.get("base_lang", "en")
+        except (ValueError, KeyError) as e:
+            self.send_json(400, {"error": f"invalid request: {e}"})
+            return
+        if target_lang not in lang_dict:
+            self.send_json(400, {"error": f"Unsupported target language: {target_lang}"})
+            return
+
+        if self.path == "/translate":
+            try:
+                translation = self.server.translator.translate_text(payload.get("text", ""), base_lang, target_lang)
+            except Exception as e:
+                self.send_json(502, {"error": str(e)})
+                return
+            self.send_json(200, {"translation": translation})
+        elif self.path == "/jobs" and "input_dir" in payload:
+            self.send_json(202, self.server.start_job(payload["input_dir"], payload.get("output_dir"), base_lang, target_lang,
+                                                      bool(payload.get("watch"))))
         else:
-            output_path = file_path.replace(".md", f".{target_lang}.md")
-        translate_file(file_path, output_path, base_lang, target_lang, client)
+            self.send_json(404, {"error": "not found"})
 
-    print("\nAll files processed.")
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # Unix socket peers have no address.
+        return self.client_address[0] if self.client_address else "local"
+
+class DaemonServerMixin:
+    """Shared Translator and job table for the TCP and Unix socket servers."""
+
+    daemon_threads = True
+
+    def setup_daemon(self, translator):
+        self.translator = translator
+        self.jobs = {}
+        self.job_ids = itertools.count(1)
+        self.jobs_lock = threading.Lock()
+
+    def start_job(self, input_dir, output_dir, base_lang, target_lang, watch=False):
+        with self.jobs_lock:
+            job = {"id": str(next(self.job_ids)), "status": "queued", "input_dir": input_dir, "target_lang": target_lang}
+            self.jobs[job["id"]] = job
+        threading.Thread(target=self.run_job, args=(job, input_dir, output_dir, base_lang, target_lang, watch), daemon=True).start()
+        return job
+
+    def run_job(self, job, input_dir, output_dir, base_lang, target_lang, watch):
+        job["status"] = "running"
+        try:
+            self.translator.translate_directory(input_dir, output_dir, base_lang, target_lang)
+            if watch:
+                job["status"] = "watching"
+                self.translator.watch_directory(input_dir, output_dir, base_lang, target_lang)
+            job["status"] = "done"
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = str(e)
+
+class DaemonTCPServer(DaemonServerMixin, ThreadingHTTPServer):
+    pass
+
+class DaemonUnixServer(DaemonServerMixin, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    pass
+
+def add_translator_arguments(parser):
+    """Arguments that configure a Translator, shared by the CLI and the daemon."""
+    parser.add_argument('--profile', metavar='profile', default=DEFAULT_PROFILE, type=str, help='Model profile (model, chunk size, output budget, prompt set, workers). Built in: ' + ', '.join(MODEL_PROFILES) + '. Default: ' + DEFAULT_PROFILE)
+    parser.add_argument('--profiles-file', metavar='path', type=str, help='JSON file with additional or tuned profiles. Default: ' + PROFILES_FILE + ' if it exists.')
+    parser.add_argument('--workers', metavar='workers', type=int, help='Maximum number of concurrent requests per endpoint; the actual level adapts to observed latency. Default: from the profile.')
+    parser.add_argument('--schedule', metavar='policy', default="fifo", choices=SCHEDULE_POLICIES, help='Order of work: fifo (directory order), shortest (shortest files first) or round-robin (interleave chunks across files).')
+    parser.add_argument('--priority', metavar='glob', action='append', default=[], help='Translate files matching this glob (e.g. "docs/getting-started/**") before all others. May be repeated; earlier globs win.')
+    parser.add_argument('--api-url', metavar='url', action='append', help='Base URL of an Ollama endpoint. Repeat to spread work over several endpoints. Default: ' + API_URL)
+    parser.add_argument('--model', metavar='model', type=str, help='Ollama model used for translation. Default: from the profile.')
+    parser.add_argument('--fast-model', metavar='model', type=str, help='Small model for chunks made of headings, list items, table cells and short lines; chunks it fails on are retranslated with --model.')
+    parser.add_argument('--backend', metavar='backend', default=API_BACKEND, choices=API_BACKENDS, help='API to use: openai (OpenAI-compatible ' + API_ENDPOINT + ') or ollama (native ' + OLLAMA_ENDPOINT + ' with a context sized per request and server timing stats). Default: ' + API_BACKEND)
+    parser.add_argument('--request-log', metavar='path', type=str, help='With the ollama backend, append the server timing of every request to this JSON lines file.')
+    parser.add_argument('--rate-limits', metavar='path', type=str, help='JSON file with requests/s and tokens/min limits per endpoint and time of day. Re-read when it changes or on SIGHUP.')
+    parser.add_argument('--hedge', action='store_true', help='Send a duplicate of a chunk to another endpoint when it takes longer than the running p95 latency; the first answer wins.')
+    parser.add_argument('--hedge-budget', metavar='fraction', default=HEDGE_BUDGET, type=float, help=f'Maximum share of extra requests caused by hedging. Default: {HEDGE_BUDGET}')
+    parser.add_argument('--no-validate', action='store_true', help='Do not check translated chunks for broken structure and retranslate the ones that fail.')
+    parser.add_argument('--no-language-check', action='store_true', help='Send every file and chunk to the model, even those that already look like the target language or have no prose.')
+    parser.add_argument('--history-file', metavar='path', default=HISTORY_FILE, type=str, help='File where each run appends its throughput, used by --plan. Default: ' + HISTORY_FILE)
+    parser.add_argument('--chunk-cache', metavar='chunks', default=CHUNK_CACHE_SIZE, type=int, help=f'Number of translated chunks kept in memory for reuse by identical chunks. Default: {CHUNK_CACHE_SIZE}')
+    parser.add_argument('--cpu-workers', metavar='processes', default=CPU_WORKERS, type=int, help=f'Processes used to read, split and hash files. Default: {CPU_WORKERS} (one per CPU).')
+
+def create_translator(args):
+    translator = Translator.from_profile(args.profile, args.profiles_file, api_urls=args.api_url, api_key=API_KEY, model=args.model,
+                                   workers=args.workers, policy=args.schedule, priority_globs=args.priority,
+                                   cpu_workers=args.cpu_workers, validate=not args.no_validate,
+                                   hedge_budget=args.hedge_budget if args.hedge else 0.0, history_file=args.history_file,
+                                   backend=args.backend, request_log=args.request_log, rate_limits=args.rate_limits,
+                                   fast_model=args.fast_model, cache_size=args.chunk_cache,
+                                   language_check=not args.no_language_check)
+    if args.rate_limits and hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda signum, frame: translator.scheduler.rate_limiter.reload())
+    return translator
+
+def daemon_main(argv):
+    parser = argparse.ArgumentParser(prog="ollama-translator.py daemon", description="Keep a translator running and accept translation jobs over HTTP.")
+    parser.add_argument('--host', metavar='host', default=DAEMON_HOST, type=str, help='Address to listen on. Default: ' + DAEMON_HOST)
+    parser.add_argument('--port', metavar='port', default=DAEMON_PORT, type=int, help=f'TCP port to listen on. Default: {DAEMON_PORT}')
+    parser.add_argument('--socket', metavar='path', type=str, help='Listen on this Unix socket instead of TCP.')
+    add_translator_arguments(parser)
+    args = parser.parse_args(argv)
+
+    translator = create_translator(args)
+    translator.warm_up()
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = DaemonUnixServer(args.socket, DaemonRequestHandler)
+        print(f"Daemon listening on {args.socket}")
+    else:
+        server = DaemonTCPServer((args.host, args.port), DaemonRequestHandler)
+        print(f"Daemon listening on http://{args.host}:{args.port}")
+    server.setup_daemon(translator)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down daemon.")
+    finally:
+        server.server_close()
+        translator.close()
+
+def autotune_sample(input_dir, sample_tokens):
+    """Concatenate markdown files from the input directory up to roughly sample_tokens tokens."""
+    sample = ""
+    for file_path in sorted(scan_directory(input_dir)):
+        with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+            sample += f.read() + "\n"
+        if count_tokens(sample) >= sample_tokens:
+            break
+    return sample[:sample_tokens * 4]
+
+def autotune_measure(chunks, concurrency, base_lang, target_lang, client, api_urls, profile):
+    """Translate chunks at a fixed concurrency and return (tokens/s, truncation rate)."""
+    def translate(index):
+        return request_translation(chunks[index], base_lang, target_lang, client, api_urls[index % len(api_urls)],
+                                   profile["model"], max_tokens=profile["max_tokens"], prompt_set=profile["prompt_set"],
+                                   backend=profile["backend"])
+
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency * len(api_urls)) as executor:
+        results = list(executor.map(translate, range(len(chunks))))
+    elapsed_time = time.time() - start_time
+    tokens = sum(result["output_tokens"] for result in results)
+    truncated = sum(1 for result in results if result["finish_reason"] == "length")
+    return tokens / elapsed_time, truncated / len(results)
+
+def autotune_main(argv):
+    parser = argparse.ArgumentParser(prog="ollama-translator.py autotune", description="Measure throughput at several chunk sizes and concurrency levels and save the best settings to a profile.")
+    parser.add_argument('--input-dir', metavar='input directory', type=str, required=True, help='Directory with a representative sample of the markdown corpus.')
+    parser.add_argument('--base-lang', metavar='base_lang', default="en", type=str, help='The base language to translate from.')
+    parser.add_argument('--target-lang', metavar='target_lang', type=str, required=True, help='The target language to translate to.')
+    parser.add_argument('--profile', metavar='profile', default=DEFAULT_PROFILE, type=str, help='Profile to tune and update. Default: ' + DEFAULT_PROFILE)
+    parser.add_argument('--profiles-file', metavar='path', type=str, help='Where the tuned profile is saved. Default: ' + PROFILES_FILE)
+    parser.add_argument('--api-url', metavar='url', action='append', help='Base URL of an Ollama endpoint. May be repeated. Default: ' + API_URL)
+    parser.add_argument('--backend', metavar='backend', default=API_BACKEND, choices=API_BACKENDS, help='API to use: openai or ollama. Default: ' + API_BACKEND)
+    parser.add_argument('--chunk-sizes', metavar='sizes', default="256,512,1024,2048", type=str, help='Comma-separated chunk sizes in tokens to try.')
+    parser.add_argument('--concurrency', metavar='levels', default="1,2,4,8", type=str, help='Comma-separated concurrency levels per endpoint to try.')
+    parser.add_argument('--sample-tokens', metavar='tokens', default=8192, type=int, help='Approximate size of the corpus sample in tokens.')
+    parser.add_argument('--max-truncation', metavar='rate', default=0.02, type=float, help='Highest acceptable rate of truncated outputs.')
+    args = parser.parse_args(argv)
+
+    profiles = load_profiles(args.profiles_file)
+    if args.profile not in profiles:
+        print(f"Unknown profile: {args.profile}")
+        return
+    profile = profiles[args.profile]
+    api_urls = args.api_url or [API_URL]
+    client = initialize_api_client(API_KEY)
+    sample = autotune_sample(args.input_dir, args.sample_tokens)
+    if not sample.strip():
+        print(f"No markdown content found in {args.input_dir}")
+        return
+
+    results = []
+    for chunk_tokens in [int(size) for size in args.chunk_sizes.split(",")]:
+        chunks = split_text(sample, chunk_tokens)
+        print()
+        # Leave room for translations that come out longer than the source.
+        trial = dict(profile_settings(profile), chunk_tokens=chunk_tokens, max_tokens=chunk_tokens * 2, backend=args.backend)
+        for concurrency in [int(level) for level in args.concurrency.split(",")]:
+            try:
+                tokens_per_second, truncation_rate = autotune_measure(chunks, concurrency, args.base_lang, args.target_lang,
+                                                                      client, api_urls, trial)
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                print(f"chunk size {chunk_tokens}, concurrency {concurrency}: failed ({e})")
+                continue
+            print(f"chunk size {chunk_tokens}, concurrency {concurrency}: {tokens_per_second:.1f} tokens/s, "
+                  f"{truncation_rate:.1%} truncated")
+            results.append((truncation_rate <= args.max_truncation, tokens_per_second, -truncation_rate, chunk_tokens, concurrency))
+
+    if not results:
+        print("No successful measurements; profile not changed.")
+        return
+    _, tokens_per_second, _, chunk_tokens, concurrency = max(results)
+    profile.update({"chunk_tokens": chunk_tokens, "max_tokens": chunk_tokens * 2, "workers": concurrency})
+    save_profile(args.profile, profile, args.profiles_file)
+    print(f"Best: chunk size {chunk_tokens}, concurrency {concurrency} ({tokens_per_second:.1f} tokens/s). "
+          f"Saved profile '{args.profile}' to {args.profiles_file or PROFILES_FILE}")
+
+class JobQueue:
+    """Durable queue of chunk translation tasks in a SQLite database.
+
+    Tasks are unique per (chunk, language pair) and are leased to workers for
+    QUEUE_LEASE_SECONDS. Workers extend their leases with heartbeats; a lease that
+    expires (the worker died or hung) makes the task available to other workers.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY,
+            digest TEXT NOT NULL,
+            base_lang TEXT NOT NULL,
+            target_lang TEXT NOT NULL,
+            chunk TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            lease_owner TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            result TEXT,
+            error TEXT,
+            UNIQUE (digest, base_lang, target_lang)
+        );
+        CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, lease_expires);
+        CREATE TABLE IF NOT EXISTS files (
+            id INTEGER PRIMARY KEY,
+            input_path TEXT NOT NULL,
+            output_path TEXT NOT NULL UNIQUE,
+            assembled INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS file_chunks (
+            file_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            task_id INTEGER NOT NULL,
+            PRIMARY KEY (file_id, position)
+        );
+    """
+
+    def __init__(self, path, wal=True):
+        self.path = path
+        self.wal = wal
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        # WAL needs shared memory, so it only works when every process is on the same host.
+        self.connection.execute("PRAGMA journal_mode=WAL" if wal else "PRAGMA journal_mode=DELETE")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def enqueue_file(self, input_path, output_path, chunks, base_lang, target_lang):
+        """Add a file and its chunks; returns the number of chunks that were new tasks."""
+        added = 0
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.execute("DELETE FROM file_chunks WHERE file_id IN (SELECT id FROM files WHERE output_path = ?)", (output_path,))
+            self.connection.execute("DELETE FROM files WHERE output_path = ?", (output_path,))
+            file_id = self.connection.execute("INSERT INTO files (input_path, output_path) VALUES (?, ?)",
+                                              (input_path, output_path)).lastrowid
+            for position, chunk in enumerate(chunks):
+                digest = hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+                cursor = self.connection.execute(
+                    "INSERT OR IGNORE INTO tasks (digest, base_lang, target_lang, chunk) VALUES (?, ?, ?, ?)",
+                    (digest, base_lang, target_lang, chunk))
+                added += cursor.rowcount
+                task_id = self.connection.execute(
+                    "SELECT id FROM tasks WHERE digest = ? AND base_lang = ? AND target_lang = ?",
+                    (digest, base_lang, target_lang)).fetchone()[0]
+                self.connection.execute("INSERT INTO file_chunks (file_id, position, task_id) VALUES (?, ?, ?)",
+                                        (file_id, position, task_id))
+        return added
+
+    def fail_expired(self, now):
+        """Fail tasks whose last allowed lease expired; a chunk that kills or hangs its worker is not retried forever."""
+        self.connection.execute(
+            "UPDATE tasks SET status = 'failed', error = 'lease expired', lease_owner = NULL, lease_expires = NULL "
+            "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?", (now, QUEUE_MAX_ATTEMPTS))
+
+    def lease(self, owner, limit):
+        """Lease up to limit pending or expired tasks to owner."""
+        now = time.time()
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.fail_expired(now)
+            rows = self.connection.execute(
+                "SELECT id, chunk, base_lang, target_lang FROM tasks "
+                "WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ? AND attempts < ?) ORDER BY id LIMIT ?",
+                (now, QUEUE_MAX_ATTEMPTS, limit)).fetchall()
+            self.connection.executemany(
+                "UPDATE tasks SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                [(owner, now + QUEUE_LEASE_SECONDS, row[0]) for row in rows])
+        return rows
+
+    def heartbeat(self, owner):
+        with self.connection:
+            self.connection.execute("UPDATE tasks SET lease_expires = ? WHERE status = 'leased' AND lease_owner = ?",
+                                    (time.time() + QUEUE_LEASE_SECONDS, owner))
+
+    def complete(self, task_id, result):
+        # A late result from a worker whose lease expired is still a valid translation.
+        with self.connection:
+            self.connection.execute(
+                "UPDATE tasks SET status = 'done', result = ?, lease_owner = NULL, lease_expires = NULL "
+                "WHERE id = ? AND status != 'done'", (result, task_id))
+
+    def fail(self, task_id, owner, error):
+        with self.connection:
+            self.connection.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "error = ?, lease_owner = NULL, lease_expires = NULL WHERE id = ? AND lease_owner = ?",
+                (QUEUE_MAX_ATTEMPTS, error, task_id, owner))
+
+    def counts(self):
+        return dict(self.connection.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+
+    def assemble(self):
+        """Write every file whose chunks are all done; returns (outputs, waiting), outputs counting write results."""
+        outputs = collections.Counter()
+        created_dirs = set()
+        waiting = 0
+        # With every worker gone, nothing else would fail the tasks they left behind.
+        with self.connection:
+            self.fail_expired(time.time())
+        files = self.connection.execute("SELECT id, output_path FROM files WHERE assembled = 0").fetchall()
+        for file_id, output_path in files:
+            rows = self.connection.execute(
+                "SELECT tasks.status, tasks.result FROM file_chunks JOIN tasks ON tasks.id = file_chunks.task_id "
+                "WHERE file_chunks.file_id = ? ORDER BY file_chunks.position", (file_id,)).fetchall()
+            if any(status != 'done' for status, _ in rows):
+                waiting += 1
+                continue
+            outputs[write_translation(output_path, ''.join(result for _, result in rows), created_dirs)] += 1
+            with self.connection:
+                self.connection.execute("UPDATE files SET assembled = 1 WHERE id = ?", (file_id,))
+        return outputs, waiting
+
+def enqueue_main(argv):
+    parser = argparse.ArgumentParser(prog="ollama-translator.py enqueue", description="Split a directory into chunk tasks in a shared work queue.")
+    parser.add_argument('--queue', metavar='path', type=str, required=True, help='SQLite database holding the work queue; created if missing.')
+    parser.add_argument('--no-wal', action='store_true', help='Use a rollback journal instead of WAL, for a queue on a network filesystem shared by several machines.')
+    parser.add_argument('--base-lang', metavar='base_lang', default="en", type=str, help='The base language to translate from.')
+    parser.add_argument('--target-lang', metavar='target_lang', type=str, required=True, help='The target language to translate to.')
+    parser.add_argument('--input-dir', metavar='input directory', type=str, required=True, help='Path to the directory containing input files.')
+    parser.add_argument('--output-dir', metavar='output directory', type=str, help='Path to the directory where output files will be saved')
+    parser.add_argument('--profile', metavar='profile', default=DEFAULT_PROFILE, type=str, help='Profile whose chunk size is used. Default: ' + DEFAULT_PROFILE)
+    parser.add_argument('--profiles-file', metavar='path', type=str, help='JSON file with additional or tuned profiles.')
+    args = parser.parse_args(argv)
+
+    if args.target_lang not in lang_dict:
+        print(f"Unsupported target language: {args.target_lang}")
+        return
+    profiles = load_profiles(args.profiles_file)
+    if args.profile not in profiles:
+        print(f"Unknown profile: {args.profile}")
+        return
+    chunk_tokens = profile_settings(profiles[args.profile])["chunk_tokens"]
+    job_queue = JobQueue(args.queue, not args.no_wal)
+    all_files = scan_directory(args.input_dir)
+    added = 0
+    for i, file_path in enumerate(all_files):
+        file_content = read_source_file(file_path)
+        if file_content is None:
+            continue
+        chunks = split_text(file_content, chunk_tokens)
+        print()
+        output_path = get_output_path(file_path, args.input_dir, args.output_dir, args.target_lang)
+        added += job_queue.enqueue_file(os.path.abspath(file_path), os.path.abspath(output_path), chunks, args.base_lang, args.target_lang)
+    print(f"Queued {len(all_files)} files, {added} new tasks. Queue status: {job_queue.counts()}")
+    job_queue.close()
+
+def worker_main(argv):
+    parser = argparse.ArgumentParser(prog="ollama-translator.py worker", description="Translate tasks from a shared work queue. Run any number of workers on any machine.")
+    parser.add_argument('--queue', metavar='path', type=str, required=True, help='SQLite database holding the work queue.')
+    parser.add_argument('--no-wal', action='store_true', help='Use a rollback journal instead of WAL, for a queue on a network filesystem shared by several machines.')
+    parser.add_argument('--wait', action='store_true', help='Keep polling for new tasks instead of exiting when the queue is drained.')
+    add_translator_arguments(parser)
+    args = parser.parse_args(argv)
+
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    translator = create_translator(args)
+    scheduler = translator.scheduler
+    capacity = sum(limiter.max_limit for limiter in scheduler.endpoints.limiters)
+    job_queue = JobQueue(args.queue, not args.no_wal)
+    finished = queue.Queue()
+    stop_heartbeat = threading.Event()
+
+    def heartbeat():
+        heartbeat_queue = JobQueue(args.queue, not args.no_wal)
+        while not stop_heartbeat.wait(QUEUE_HEARTBEAT_SECONDS):
+            heartbeat_queue.heartbeat(owner)
+        heartbeat_queue.close()
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+    print(f"Worker {owner} started")
+    in_flight = {}
+    completed = 0
+    try:
+        while True:
+            if len(in_flight) < capacity:
+                for task_id, chunk, base_lang, target_lang in job_queue.lease(owner, capacity - len(in_flight)):
+                    future = scheduler.submit(chunk, base_lang, target_lang)
+                    in_flight[task_id] = future
+                    future.add_done_callback(lambda done, task_id=task_id: finished.put((task_id, done)))
+            if not in_flight:
+                counts = job_queue.counts()
+                if not args.wait and not counts.get("pending") and not counts.get("leased"):
+                    break
+                # Remaining tasks are leased by other workers; they come back if those leases expire.
+                time.sleep(QUEUE_POLL_INTERVAL)
+                continue
+            try:
+                task_id, future = finished.get(timeout=QUEUE_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            del in_flight[task_id]
+            if future.exception() is not None:
+                print(f"Task {task_id} failed: {future.exception()}")
+                job_queue.fail(task_id, owner, str(future.exception()))
+            else:
+                job_queue.complete(task_id, future.result())
+                completed += 1
+    finally:
+        stop_heartbeat.set()
+        translator.close()
+    print(f"Worker {owner} finished: {completed} tasks completed. Queue status: {job_queue.counts()}")
+    job_queue.close()
+
+def assemble_main(argv):
+    parser = argparse.ArgumentParser(prog="ollama-translator.py assemble", description="Write output files whose chunks have all been translated by workers.")
+    parser.add_argument('--queue', metavar='path', type=str, required=True, help='SQLite database holding the work queue.')
+    parser.add_argument('--no-wal', action='store_true', help='Use a rollback journal instead of WAL, for a queue on a network filesystem shared by several machines.')
+    parser.add_argument('--wait', action='store_true', help='Keep assembling until every file is written or its tasks failed.')
+    args = parser.parse_args(argv)
+
+    job_queue = JobQueue(args.queue, not args.no_wal)
+    outputs = collections.Counter()
+    while True:
+        assembled, waiting = job_queue.assemble()
+        outputs.update(assembled)
+        counts = job_queue.counts()
+        if not args.wait or not waiting or (not counts.get("pending") and not counts.get("leased")):
+            break
+        time.sleep(QUEUE_POLL_INTERVAL)
+    print(f"Assembled {sum(outputs.values())} files, {waiting} still waiting. Queue status: {counts}")
+    print_output_summary(outputs)
+    if counts.get("failed"):
+        print(f"{counts['failed']} tasks failed after {QUEUE_MAX_ATTEMPTS} attempts; their files were not written.")
+    job_queue.close()
+
+def merge_reports_main(argv):
+    parser = argparse.ArgumentParser(prog="ollama-translator.py merge-reports", description="Combine the --metrics-file reports of sharded runs.")
+    parser.add_argument('reports', metavar='report', nargs='+', help='Metrics files written by the shards.')
+    parser.add_argument('--output', metavar='path', type=str, help='Write the combined metrics to this JSON file.')
+    args = parser.parse_args(argv)
+
+    reports = []
+    for path in args.reports:
+        with open(path, "r", encoding="utf-8") as f:
+            reports.append(json.load(f))
+    merged = merge_metrics(reports)
+    counts = {int(shard.split("/")[1]) for shard in merged["shards"] if shard}
+    if len(counts) == 1:
+        count = counts.pop()
+        missing = sorted(set(range(1, count + 1)) - {int(shard.split("/")[0]) for shard in merged["shards"] if shard})
+        if missing:
+            print(f"Warning: missing shards {', '.join(f'{index}/{count}' for index in missing)}")
+    outputs = merged.get("outputs", {})
+    print(f"Shards: {len(reports)}, files: {merged.get('files', 0)}, chunks: {merged.get('submitted', 0)} submitted, "
+          f"{merged.get('submitted', 0) - merged.get('deduplicated', 0)} translated")
+    print(f"Requests: {merged.get('requests', 0)}, tokens: {merged.get('input_tokens', 0)} in, {merged.get('output_tokens', 0)} out")
+    print(f"Output files: {outputs.get('written', 0)} written, {outputs.get('unchanged', 0)} unchanged, {outputs.get('failed', 0)} failed")
+    print(f"Validation failures: {len(merged.get('failures', []))}")
+    print(f"Elapsed: {merged.get('elapsed', 0):.2f}s for the slowest shard")
+    if args.output:
+        write_metrics(args.output, merged)
+
+class EchoRequestHandler(BaseHTTPRequestHandler):
+    """OpenAI-compatible endpoint that answers every request with its own input, for benchmarks."""
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        content = payload["messages"][-1]["content"]
+        data = json.dumps({"choices": [{"message": {"content": content}, "finish_reason": "stop"}],
+                           "usage": {"completion_tokens": count_tokens(content)}}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def build_synthetic_tree(root, file_count, files_per_directory=100):
+    """Write file_count small markdown files of distinct content below root."""
+    for index in range(file_count):
+        directory = os.path.join(root, f"section-{index // files_per_directory:05d}")
+        if index % files_per_directory == 0:
+            os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"page-{index:07d}.md"), "w", encoding="utf-8") as f:
+            f.write(f"# Page {index}\n\n" + f"This is paragraph {index} of the synthetic benchmark tree. " * 12 + "\n")
+
+def memory_benchmark_main(argv):
+    parser = argparse.ArgumentParser(prog="ollama-translator.py memory-benchmark", description="Translate synthetic trees of growing size against a local echo endpoint and report the peak memory of each run.")
+    parser.add_argument('--sizes', metavar='counts', default="1000,4000,16000", type=str, help='Comma-separated numbers of files. Default: 1000,4000,16000')
+    parser.add_argument('--workers', metavar='workers', default=API_WORKERS, type=int, help=f'Concurrent requests. Default: {API_WORKERS}')
+    parser.add_argument('--chunk-cache', metavar='chunks', default=1000, type=int, help='Translated chunks kept for reuse. Default: 1000, below the smallest tree, so the cache is full in every run.')
+    args = parser.parse_args(argv)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), EchoRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{server.server_port}"
+    # Python allocations only; preprocessing stays in this process so it is counted too.
+    tracemalloc.start()
+    print(f"{'files':>10} {'peak MB':>10} {'seconds':>10}")
+    for file_count in (int(size) for size in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as root:
+            input_dir = os.path.join(root, "docs")
+            build_synthetic_tree(input_dir, file_count)
+            translator = Translator(api_urls=[api_url], workers=args.workers, cpu_workers=1, validate=False,
+                                    cache_size=args.chunk_cache)
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            start_time = time.time()
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                translator.translate_directory(input_dir, os.path.join(root, "docs-de"), "en", "de")
+            peak = tracemalloc.get_traced_memory()[1] - baseline
+            translator.close()
+        print(f"{file_count:>10} {peak / 1e6:>10.1f} {time.time() - start_time:>10.1f}")
+    tracemalloc.stop()
+    server.shutdown()
+
+COMMANDS = {
+    "daemon": daemon_main,
+    "autotune": autotune_main,
+    "enqueue": enqueue_main,
+    "worker": worker_main,
+    "assemble": assemble_main,
+    "merge-reports": merge_reports_main,
+    "memory-benchmark": memory_benchmark_main,
+}
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        COMMANDS[sys.argv[1]](sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(description="Translate markdown files using a local Ollama model. Supported languages are: " + ", ".join(f"{k}: {v}" for k, v in lang_dict.items()))
 
     parser.add_argument('--base-lang', metavar='base_lang', default="en", type=str, help='The base language to translate from. Choose from: ' + ', '.join(lang_dict.keys()))
@@ -209,6 +2975,15 @@ def main():
     parser.add_argument('--recursive', action='store_true', help='If set, recurses through subdirectories within the input directory.')
     parser.add_argument('--output-dir', metavar='output directory', type=str, help='Path to the directory where output files will be saved')
     parser.add_argument('--output-origin', action='store_true', help='Save output files to the same directory as the source files')
+    parser.add_argument('--validation-report', metavar='path', type=str, help='Write a JSON report of chunks that still fail validation after retranslation.')
+    parser.add_argument('--watch', action='store_true', help='After translating the directory, keep watching it and retranslate files shortly after they are saved.')
+    parser.add_argument('--i18n', action='store_true', help='Translate the string values of JSON, YAML and gettext PO locale files instead of markdown files, many strings per request.')
+    parser.add_argument('--plan', action='store_true', help='Only estimate the files, chunks, tokens, requests and duration of the run, without calling the API.')
+    parser.add_argument('--queue', metavar='path', type=str, help='With --plan, leave out chunks already translated in this work queue.')
+    parser.add_argument('--shard', metavar='i/N', type=parse_shard, help='Only translate shard i of N (1-based), balanced by estimated tokens. Every runner computes the same split.')
+    parser.add_argument('--metrics-file', metavar='path', type=str, help='Write the metrics of the run to this JSON file; combine shards with the merge-reports command.')
+    parser.add_argument('--profiling', metavar='directory', type=str, help='Profile the run and write a per-phase time breakdown, collapsed stacks for flamegraph tools and the hottest functions to this directory.')
+    add_translator_arguments(parser)
 
     args = parser.parse_args()
 
@@ -216,12 +2991,56 @@ def main():
         print(f"Unsupported target language: {args.target_lang}")
         return
 
-    client = initialize_api_client(API_KEY)
+    if args.i18n and args.shard:
+        print("--shard is not supported with --i18n")
+        return
+
+    if args.plan:
+        profiles = load_profiles(args.profiles_file)
+        if args.profile not in profiles:
+            print(f"Unknown profile: {args.profile}")
+            return
+        profile = profile_settings(profiles[args.profile])
+        plan_directory(args.input_dir, args.base_lang, args.target_lang, args.model or profile["model"], profile["chunk_tokens"],
+                       profile["prompt_set"], args.cpu_workers, args.queue, args.history_file, args.shard,
+                       not args.no_language_check)
+        return
+
+    profiler = None
+    if args.profiling:
+        phase_timer.enabled = True
+        profiler = SamplingProfiler()
+        profiler.start()
+
+    translator = create_translator(args)
 
     output_dir = None if args.output_origin else args.output_dir
 
-    if args.input_dir:
-        process_directory(args.input_dir, output_dir, args.base_lang, args.target_lang, args.recursive, client)
+    try:
+        if args.i18n:
+            translator.translate_i18n_directory(args.input_dir, output_dir, args.base_lang, args.target_lang)
+        elif args.input_dir:
+            translator.translate_directory(args.input_dir, output_dir, args.base_lang, args.target_lang, args.recursive,
+                                           args.validation_report, args.shard, args.metrics_file)
+            if args.watch:
+                try:
+                    translator.watch_directory(args.input_dir, output_dir, args.base_lang, args.target_lang)
+                except KeyboardInterrupt:
+                    print("\nStopped watching.")
+    finally:
+        translator.close()
+        if profiler:
+            profiler.stop()
+            write_profile(args.profiling, profiler)
+
+def write_profile(output_dir, profiler):
+    profiler.write(output_dir)
+    report = phase_timer.report()
+    with open(os.path.join(output_dir, "phases.txt"), "w", encoding="utf-8") as f:
+        f.write(report + "\n")
+    print("\nPhase breakdown (summed over threads):")
+    print(report)
+    print(f"Profile written to {output_dir}: phases.txt, stacks.collapsed, hot_functions.txt")
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,17 @@
+"""Import shim for using the tool as a library.
+
+The command-line script is named ``ollama-translator.py``, which is not a valid module
+name. Importing this module loads that script and registers it under
+``ollama_translator``:
+
+    from ollama_translator import Translator
+"""
+import importlib.util
+import os
+import sys
+
+_spec = importlib.util.spec_from_file_location(
+    __name__, os.path.join(os.path.dirname(os.path.abspath(__file__)), "ollama-translator.py"))
+_module = importlib.util.module_from_spec(_spec)
+sys.modules[__name__] = _module
+_spec.loader.exec_module(_module)